@@ -1,108 +1,843 @@
+import argparse
 import json
 import subprocess
 import hashlib
 import requests
 import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError as TransferError
+from urllib3.util.retry import Retry
 
-def create_conda_env():
-    print("Initiating process: Creating of conda environment")
-    subprocess.run(['conda', 'create', '--name', 'temp', '--dry-run', '--json', 'jupyterlab', '-c', 'conda-forge'], stdout=open('dependencies.json', 'w'))
+BASE_URL = 'https://anaconda.org'
+CHANNEL_BASE_URL = 'https://conda.anaconda.org'
+CHUNK_SIZE = 1024 * 1024
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'flatpak-conda')
+# Seconds to connect and seconds without any data before a request is given up
+DEFAULT_TIMEOUT = (10, 60)
+FORMATS = ('.conda', '.tar.bz2')
+# Flatpak architecture of every conda subdir a manifest can be generated for
+PLATFORM_ARCHES = {
+    'linux-64': 'x86_64',
+    'linux-aarch64': 'aarch64',
+    'linux-32': 'i386',
+    'linux-armv7l': 'arm'
+}
 
-def load_json_file():
-    print("Initiating process: Loading JSON file")
-    with open('dependencies.json', 'r') as file:
+DEFAULT_SPECS = ['jupyterlab']
+DEFAULT_CHANNELS = ['conda-forge']
+# Executable and create options of every solver, each is run as '<executable> create <options> --dry-run --json ...'
+SOLVER_COMMANDS = {
+    'conda': (['conda'], []),
+    'libmamba': (['conda'], ['--solver', 'libmamba']),
+    'mamba': (['mamba'], [])
+}
+# Strings that YAML would read as something else than a string are quoted
+YAML_PLAIN_PATTERN = re.compile(r'[A-Za-z_/$][\w./:$-]*')
+YAML_RESERVED = {'true', 'false', 'yes', 'no', 'on', 'off', 'null', 'y', 'n'}
+OUTPUT_FORMATS = {'.yml': 'yaml', '.yaml': 'yaml', '.json': 'json'}
+
+# Format found for each package by probing, so a package is probed at most once per run
+resolved_formats = {}
+resolved_formats_lock = threading.Lock()
+
+class DownloadError(Exception):
+    pass
+
+class Journal:
+    # Append-only JSON lines record of the packages a run has finished, one line per package
+    # written as soon as it is done, so an interrupted or failed run resumes where it stopped
+    def __init__(self, path, resume=True):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        if resume and os.path.exists(path):
+            with open(path, 'r') as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # The last line is cut short if the run was killed while writing it
+                        continue
+                    self.entries[entry['key']] = entry
+        self.file = open(path, 'a' if resume else 'w')
+
+    def get(self, link):
+        entry = self.entries.get(package_key(link))
+        return entry if entry and entry['status'] == 'done' else None
+
+    def record(self, link, status, **fields):
+        entry = dict(key=package_key(link), status=status, **fields)
+        with self.lock:
+            self.entries[entry['key']] = entry
+            self.file.write(json.dumps(entry) + '\n')
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class DownloadMetrics:
+    # Size, latency, throughput and retries of every package of the download stage. Each worker
+    # thread records into the package it is currently processing, so the download functions
+    # only report what they see without knowing which package they belong to.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.records = []
+        self.total = 0
+        self.concurrency = None
+        self.done = 0
+        self.bytes = 0
+        self.retries = 0
+        self.started = None
+        self.finished = None
+        self.reporter = None
+        self.stopped = threading.Event()
+
+    def begin(self, total, concurrency):
+        self.total = total
+        self.concurrency = concurrency
+        self.started = time.time()
+
+    def start(self, link):
+        self.local.record = {
+            'package': link['dist_name'],
+            'platform': link['platform'],
+            'source': 'download',
+            'size': 0,
+            'latency': None,
+            'seconds': 0,
+            'throughput': None,
+            'retries': 0,
+            'started': time.time()
+        }
+
+    def set_source(self, source):
+        self.local.record['source'] = source
+
+    def add_response(self, started, retries):
+        # Time to the response headers, summed over both formats if the first one was missing
+        record = self.local.record
+        record['latency'] = (record['latency'] or 0) + time.time() - started
+        record['retries'] += retries
+        with self.lock:
+            self.retries += retries
+
+    def add_chunk(self, size):
+        self.local.record['size'] += size
+        with self.lock:
+            self.bytes += size
+
+    def finish(self, source=None):
+        record = self.local.record
+        if source:
+            record['source'] = source
+        record['seconds'] = round(time.time() - record.pop('started'), 3)
+        if record['latency'] is not None:
+            record['latency'] = round(record['latency'], 3)
+        if record['source'] == 'download' and record['seconds']:
+            record['throughput'] = round(record['size'] / record['seconds'])
+        with self.lock:
+            self.records.append(record)
+            self.done += 1
+
+    def progress_line(self):
+        with self.lock:
+            done, downloaded, retries = self.done, self.bytes, self.retries
+        elapsed = max(time.time() - self.started, 0.001)
+        line = f"Progress: {done}/{self.total} packages, {format_size(downloaded)} at {format_size(downloaded / elapsed)}/s, {retries} retries"
+        if 0 < done < self.total:
+            line += f", about {round(elapsed / done * (self.total - done))}s left"
+        return line
+
+    def start_reporter(self, interval):
+        def report():
+            last = None
+            while not self.stopped.wait(interval):
+                line = self.progress_line()
+                if line != last:
+                    print(line)
+                    last = line
+        self.reporter = threading.Thread(target=report, daemon=True)
+        self.reporter.start()
+
+    def stop_reporter(self):
+        self.finished = time.time()
+        self.stopped.set()
+        if self.reporter:
+            self.reporter.join()
+
+    def summary(self):
+        seconds = (self.finished or time.time()) - self.started
+        sources = {}
+        for record in self.records:
+            sources[record['source']] = sources.get(record['source'], 0) + 1
+        downloads = [record for record in self.records if record['source'] == 'download']
+        return {
+            'packages': self.total,
+            'concurrency': self.concurrency,
+            'seconds': round(seconds, 3),
+            'bytes': self.bytes,
+            'throughput': round(self.bytes / seconds) if seconds else None,
+            'retries': self.retries,
+            'sources': sources,
+            'slowest': sorted(downloads, key=lambda record: record['seconds'], reverse=True)[:10],
+            'records': self.records
+        }
+
+    def write(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.summary(), file, indent=2)
+        print(f"Process: Download metrics written to {path}")
+
+download_metrics = DownloadMetrics()
+
+class PackageCache:
+    # Remembers the resolved URL, format and sha256 of every package, keyed by
+    # (channel, platform, dist_name), and optionally the package files themselves.
+    # Package files are evicted least recently used first once they exceed max_size bytes.
+    def __init__(self, cache_dir, max_size, keep_blobs=False):
+        self.cache_dir = cache_dir
+        self.index_path = os.path.join(cache_dir, 'packages.json')
+        self.blob_dir = os.path.join(cache_dir, 'blobs')
+        self.max_size = max_size
+        self.keep_blobs = keep_blobs
+        self.lock = threading.Lock()
+        self.entries = {}
+        os.makedirs(self.blob_dir, exist_ok=True)
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, 'r') as file:
+                    self.entries = json.load(file)
+            except (OSError, ValueError) as e:
+                print(f"Warning: Ignoring unreadable package cache {self.index_path}: {e}")
+
+    @staticmethod
+    def key(link):
+        return package_key(link)
+
+    def get(self, link):
+        with self.lock:
+            entry = self.entries.get(self.key(link))
+            if entry:
+                entry['last_used'] = time.time()
+            return entry
+
+    def put(self, link, url, extension, sha256, size):
+        with self.lock:
+            self.entries[self.key(link)] = {
+                'url': url,
+                'format': extension,
+                'sha256': sha256,
+                'size': size,
+                'last_used': time.time()
+            }
+
+    def blob_path(self, sha256):
+        return os.path.join(self.blob_dir, sha256)
+
+    def new_blob_path(self):
+        return os.path.join(self.blob_dir, f'.partial_{uuid.uuid4().hex}')
+
+    def store_blob(self, partial_path, sha256):
+        os.replace(partial_path, self.blob_path(sha256))
+
+    def save(self):
+        with self.lock:
+            self.evict()
+            temp_path = f'{self.index_path}.{uuid.uuid4().hex[:8]}.tmp'
+            with open(temp_path, 'w') as file:
+                json.dump(self.entries, file, indent=1, sort_keys=True)
+            os.replace(temp_path, self.index_path)
+
+    def evict(self):
+        # Entries of the same artifact under several keys share one blob, which counts once
+        # and was last used when the most recent of them was
+        last_used = {}
+        for entry in self.entries.values():
+            path = self.blob_path(entry['sha256'])
+            last_used[path] = max(last_used.get(path, 0), entry['last_used'])
+        blobs = [(used, path, os.path.getsize(path)) for path, used in last_used.items() if os.path.exists(path)]
+        total_size = sum(size for _, _, size in blobs)
+        for _, path, size in sorted(blobs):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+def load_environment_file(path):
+    # PyYAML is only needed for environment files, so it is imported on demand
+    try:
+        import yaml
+    except ImportError:
+        sys.exit("Failure occurred. Reading environment files requires PyYAML (pip install pyyaml).")
+    print(f"Initiating process: Loading environment file {path}")
+    with open(path, 'r') as file:
+        data = yaml.safe_load(file) or {}
+    dependencies = data.get('dependencies') or []
+    specs = [dependency for dependency in dependencies if isinstance(dependency, str)]
+    if len(specs) != len(dependencies):
+        print(f"Warning: Ignoring pip dependencies of {path}, they are not conda packages")
+    channels = [channel for channel in data.get('channels') or [] if channel != 'nodefaults']
+    return specs, channels
+
+def normalize_spec(spec):
+    return ' '.join(spec.split()).lower()
+
+def get_solve_key(specs, channels, platform, solver):
+    # Specs are unordered but channel order decides priority, so only the specs are sorted
+    normalized = {
+        'specs': sorted({normalize_spec(spec) for spec in specs}),
+        'channels': channels,
+        'platform': platform,
+        'solver': solver
+    }
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode()).hexdigest()[:24]
+
+def solve_environment(specs, channels, platform, solver):
+    print(f"Initiating process: Solving environment for {platform} with {solver}")
+    # The prefix never exists, a dry run only needs a path that does not clash with an existing environment
+    prefix = os.path.join(tempfile.gettempdir(), f'flatpak-conda-{uuid.uuid4().hex[:8]}')
+    executable, options = SOLVER_COMMANDS[solver]
+    command = executable + ['create', *options, '--prefix', prefix, '--dry-run', '--json', '--override-channels']
+    for channel in channels:
+        command += ['-c', channel]
+    # CONDA_SUBDIR makes the solver solve for the target platform instead of the host
+    result = subprocess.run(command + specs, capture_output=True, text=True, env=dict(os.environ, CONDA_SUBDIR=platform))
+    try:
+        data = json.loads(result.stdout)
+    except ValueError:
+        data = {}
+    if 'LINK' not in data.get('actions', {}):
+        message = data.get('message') or result.stderr.strip() or 'the solver returned no packages'
+        sys.exit(f"Failure occurred. Unable to solve the environment for {platform}: {message}")
+    return data['actions']['LINK']
+
+def load_solution(path, platform):
+    # A recorded solution is the JSON output of a dry run, or just its list of LINK actions
+    path = path.replace('{platform}', platform)
+    print(f"Initiating process: Loading solution {path} for {platform}")
+    with open(path, 'r') as file:
         data = json.load(file)
-        links = data['actions']['LINK']
-        with open('links.json', 'a') as file:
-            json.dump(links, file)
-    return links
+    return data if isinstance(data, list) else data['actions']['LINK']
+
+def solve_platforms(platforms, specs, channels, solver='conda', solution=None, cache_dir=None, refresh=False):
+    # The solves are independent, so all platforms are solved at the same time
+    def solve(platform):
+        if solution:
+            return load_solution(solution, platform)
+        cache_path = None
+        if cache_dir:
+            cache_path = os.path.join(cache_dir, 'solves', f'{get_solve_key(specs, channels, platform, solver)}.json')
+            if not refresh and os.path.exists(cache_path):
+                print(f"Process: Using cached solution for {platform}")
+                with open(cache_path, 'r') as file:
+                    return json.load(file)
+        links = solve_environment(specs, channels, platform, solver)
+        if cache_path:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            temp_path = f'{cache_path}.{uuid.uuid4().hex[:8]}.tmp'
+            with open(temp_path, 'w') as file:
+                json.dump(links, file)
+            os.replace(temp_path, cache_path)
+        return links
+    with ThreadPoolExecutor(max_workers=len(platforms)) as executor:
+        return dict(zip(platforms, executor.map(solve, platforms)))
 
-def process_links(links):
+def merge_platform_links(platform_links):
+    # noarch packages are shared by every platform that needs them, so each is kept once
+    # together with the architectures it is needed on
+    links = []
+    arches = {}
+    for platform, links_of_platform in platform_links.items():
+        for link in links_of_platform:
+            key = package_key(link)
+            if key not in arches:
+                links.append(link)
+                arches[key] = []
+            if PLATFORM_ARCHES[platform] not in arches[key]:
+                arches[key].append(PLATFORM_ARCHES[platform])
+    shared = sum(1 for key in arches if len(arches[key]) > 1)
+    print(f"Process: {len(links)} unique packages across {len(platform_links)} platforms ({shared} shared)")
+    return links, arches
+
+def package_key(link):
+    return f"{link.get('channel', 'conda-forge')}/{link['platform']}/{link['dist_name']}"
+
+def get_channel_url(link):
+    return (link.get('base_url') or f"{CHANNEL_BASE_URL}/{link.get('channel', 'conda-forge')}").rstrip('/')
+
+def get_download_url(base_url, link, extension):
+    return f"{base_url}/{link.get('channel', 'conda-forge')}/{link['name']}/{link['version']}/download/{link['platform']}/{link['dist_name']}{extension}"
+
+def resolve_format(session, link, base_url):
+    # A single HEAD request for the .conda artifact tells which format the channel serves;
+    # None means the probe was inconclusive (e.g. HEAD not supported, or a 403 from signed
+    # storage URLs that only accept GET) and both must be tried
+    key = package_key(link)
+    with resolved_formats_lock:
+        if key in resolved_formats:
+            return resolved_formats[key]
+    try:
+        status = session.head(get_download_url(base_url, link, '.conda'), allow_redirects=True).status_code
+    except requests.RequestException:
+        status = None
+    if status == 200:
+        extension = '.conda'
+    elif status in (404, 410):
+        extension = '.tar.bz2'
+    else:
+        return None
+    print(f"Process: Resolved format {extension} for {link['dist_name']}")
+    with resolved_formats_lock:
+        resolved_formats[key] = extension
+    return extension
+
+def fetch_repodata(session, channel_url, channel, subdir, cache_dir=None, repodata_dir=None):
+    # A local directory laid out as <channel>/<subdir>/repodata.json can stand in for the channel
+    if repodata_dir:
+        path = os.path.join(repodata_dir, channel, subdir, 'repodata.json')
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as file:
+            return json.load(file)
+    url = f'{channel_url}/{subdir}/repodata.json'
+    headers = {}
+    cache_path = None
+    if cache_dir:
+        os.makedirs(os.path.join(cache_dir, 'repodata'), exist_ok=True)
+        cache_path = os.path.join(cache_dir, 'repodata', f'{hashlib.sha256(url.encode()).hexdigest()[:16]}.json')
+        if os.path.exists(cache_path) and os.path.exists(f'{cache_path}.etag'):
+            with open(f'{cache_path}.etag', 'r') as file:
+                headers['If-None-Match'] = file.read().strip()
+    print(f"Process: Fetching repodata from URL: {url}")
+    with session.get(url, headers=headers, stream=True) as response:
+        if response.status_code == 304:
+            print(f"Process: Cached repodata is up to date for {channel}/{subdir}")
+        elif response.status_code != 200:
+            print(f"Failure occurred. Unable to fetch repodata for {channel}/{subdir}.")
+            return None
+        elif cache_path:
+            # Stream to disk so the raw document and the parsed one are not held in memory at once
+            temp_path = f'{cache_path}.{uuid.uuid4().hex[:8]}.tmp'
+            with open(temp_path, 'wb') as file:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    file.write(chunk)
+            os.replace(temp_path, cache_path)
+            with open(f'{cache_path}.etag', 'w') as file:
+                file.write(response.headers.get('ETag', ''))
+        else:
+            return response.json()
+    with open(cache_path, 'r') as file:
+        return json.load(file)
+
+def load_package_metadata(links, session, concurrency=8, cache_dir=None, repodata_dir=None):
+    # Collect URL, format and sha256 of every package from the LINK actions themselves or,
+    # failing that, from the repodata.json of its channel and platform
+    metadata = {}
+    wanted = {}
+    for link in links:
+        if link.get('sha256') and (link.get('url') or link.get('fn')):
+            url = link.get('url') or f"{get_channel_url(link)}/{link['platform']}/{link['fn']}"
+            extension = '.conda' if url.endswith('.conda') else '.tar.bz2'
+            metadata[package_key(link)] = {'url': url, 'format': extension, 'sha256': link['sha256'], 'size': link.get('size')}
+        else:
+            group = (get_channel_url(link), link.get('channel', 'conda-forge'), link['platform'])
+            wanted.setdefault(group, []).append(link)
+
+    def load(group):
+        channel_url, channel, subdir = group
+        try:
+            repodata = fetch_repodata(session, channel_url, channel, subdir, cache_dir, repodata_dir)
+        except (requests.RequestException, OSError, ValueError) as e:
+            print(f"Failure occurred. Unable to load repodata for {channel}/{subdir}: {e}")
+            repodata = None
+        found = {}
+        if not repodata:
+            return found
+        for link in wanted[group]:
+            for extension, section in (('.conda', 'packages.conda'), ('.tar.bz2', 'packages')):
+                record = repodata.get(section, {}).get(f"{link['dist_name']}{extension}")
+                if record and record.get('sha256'):
+                    found[package_key(link)] = {
+                        'url': f"{channel_url}/{subdir}/{link['dist_name']}{extension}",
+                        'format': extension,
+                        'sha256': record['sha256'],
+                        'size': record.get('size')
+                    }
+                    break
+        return found
+
+    if wanted:
+        print(f"Initiating process: Loading repodata for {len(wanted)} channel/platform combinations")
+    with ThreadPoolExecutor(max_workers=max(min(concurrency, len(wanted)), 1)) as executor:
+        for found in executor.map(load, wanted):
+            metadata.update(found)
+    print(f"Process: Found hashes for {len(metadata)} of {len(links)} packages in channel metadata")
+    return metadata
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    # Retry never fires on a stalled connection, so every request gets a timeout unless it sets its own
+    def __init__(self, timeout=DEFAULT_TIMEOUT, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+def create_session(concurrency, retries, timeout=DEFAULT_TIMEOUT):
+    # One pooled session shared by all workers, so connections are kept alive and reused
+    session = requests.Session()
+    retry = Retry(
+        total=retries,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=['HEAD', 'GET'],
+        raise_on_status=False
+    )
+    adapter = TimeoutHTTPAdapter(timeout, pool_connections=concurrency, pool_maxsize=concurrency, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def format_size(size):
+    return f'{size / (1024 * 1024):.1f} MB'
+
+def hash_file(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256
+
+def stream_and_hash(session, url, download_paths=(), resume_path=None):
+    # Hash the package chunk by chunk as it arrives, so memory use does not depend on its size.
+    # The file only touches the disk for the given download_paths and resume_path; a partial
+    # resume_path left by an earlier run is continued with a range request.
+    offset = os.path.getsize(resume_path) if resume_path and os.path.exists(resume_path) else 0
+    headers = {'Range': f'bytes={offset}-'} if offset else {}
+    started = time.time()
+    with session.get(url, stream=True, headers=headers) as response:
+        # Retries done by urllib3 before this response are kept in its retry history
+        download_metrics.add_response(started, len(response.raw.retries.history) if response.raw.retries else 0)
+        if response.status_code == 416 and offset:
+            # The partial file is not a prefix of the package, start over
+            os.remove(resume_path)
+            return stream_and_hash(session, url, download_paths, resume_path)
+        if response.status_code == 206 and offset:
+            print(f"Process: Resuming download of {url} at {offset} bytes")
+            sha256 = hash_file(resume_path)
+            size = offset
+        elif response.status_code == 200:
+            sha256 = hashlib.sha256()
+            size = 0
+        else:
+            return None, 0
+        files = [open(path, 'wb') for path in download_paths]
+        if resume_path:
+            files.append(open(resume_path, 'ab' if size else 'wb'))
+        try:
+            # Raw bytes, so a Content-Encoding applied by the server cannot change the hash
+            for chunk in response.raw.stream(CHUNK_SIZE, decode_content=False):
+                sha256.update(chunk)
+                size += len(chunk)
+                download_metrics.add_chunk(len(chunk))
+                for file in files:
+                    file.write(chunk)
+        finally:
+            for file in files:
+                file.close()
+    return sha256.hexdigest(), size
+
+def download_package(session, link, base_url, download_dir=None, cache=None, metadata=None, arches=('x86_64',)):
+    name, dist_name = link['name'], link['dist_name']
+    entry = cache.get(link) if cache else None
+    if entry:
+        file_name = f"{name}{entry['format']}"
+        blob_path = cache.blob_path(entry['sha256'])
+        if not download_dir or os.path.exists(blob_path):
+            print(f"Process: Using cached hash for {dist_name}{entry['format']}")
+            download_metrics.set_source('cache')
+            if download_dir:
+                shutil.copyfile(blob_path, os.path.join(download_dir, file_name))
+            return file_name, make_source(entry['url'], entry['sha256'], file_name, arches)
+
+    known = metadata.get(package_key(link)) if metadata else None
+    if known:
+        file_name = f"{name}{known['format']}"
+        # The channel already publishes the hash, only download if the file itself is wanted
+        if not download_dir and not (cache and cache.keep_blobs):
+            print(f"Process: Using repodata hash for {dist_name}{known['format']}")
+            download_metrics.set_source('repodata')
+            if cache:
+                cache.put(link, known['url'], known['format'], known['sha256'], known['size'])
+            return file_name, make_source(known['url'], known['sha256'], file_name, arches)
+        candidates = [(known['url'], known['format'])]
+    else:
+        # The resolved format is tried first, the other one remains a fallback if its download fails
+        extension = resolve_format(session, link, base_url)
+        extensions = sorted(FORMATS, key=lambda candidate: candidate != extension)
+        candidates = [(get_download_url(base_url, link, extension), extension) for extension in extensions]
+
+    sha256_hash = None
+    blob_path = None
+    part_path = None
+    try:
+        for url, extension in candidates:
+            file_name = f'{name}{extension}'
+            print(f"Process: Downloading file from URL: {url}")
+            if download_dir:
+                # Kept files go through a .part file that a later run can resume
+                part_path = os.path.join(download_dir, f'{file_name}.part')
+                sha256_hash, size = stream_and_hash(session, url, resume_path=part_path)
+            else:
+                if cache and cache.keep_blobs:
+                    blob_path = cache.new_blob_path()
+                sha256_hash, size = stream_and_hash(session, url, [blob_path] if blob_path else [])
+            if sha256_hash:
+                break
+    except (requests.RequestException, TransferError) as e:
+        # Reading the raw stream bypasses requests, so a connection dropped mid-body raises urllib3 errors
+        if blob_path and os.path.exists(blob_path):
+            os.remove(blob_path)
+        raise DownloadError(f"unable to download {dist_name}: {e}")
+    if not sha256_hash:
+        if blob_path and os.path.exists(blob_path):
+            os.remove(blob_path)
+        raise DownloadError(f"{dist_name} is not available from {' or '.join(url for url, extension in candidates)}")
+    if known and sha256_hash != known['sha256']:
+        for path in (blob_path, part_path):
+            if path and os.path.exists(path):
+                os.remove(path)
+        raise DownloadError(f"hash of {url} does not match the channel metadata")
+    if part_path:
+        os.replace(part_path, os.path.join(download_dir, file_name))
+        if cache and cache.keep_blobs:
+            blob_path = cache.new_blob_path()
+            shutil.copyfile(os.path.join(download_dir, file_name), blob_path)
+    if cache:
+        if blob_path:
+            cache.store_blob(blob_path, sha256_hash)
+        cache.put(link, url, extension, sha256_hash, size)
+    return file_name, make_source(url, sha256_hash, file_name, arches)
+
+def make_source(url, sha256_hash, file_name, arches):
+    return {
+        'type': 'file',
+        'only-arches': list(arches),
+        'url': url,
+        'sha256': sha256_hash,
+        'dest-filename': file_name
+    }
+
+def process_links(links, session, base_url=BASE_URL, concurrency=8, download_dir=None, cache=None, metadata=None, arches=None, journal=None, progress_interval=0):
     install = []
     mamba_install = []
     sources = []
-    print("Initiating process: Processing each link")
-    for link in links:
-        name, version, platform, dist_name = link['name'], link['version'], link['platform'], link['dist_name']
-        url = f'https://anaconda.org/conda-forge/{name}/{version}/download/{platform}/{dist_name}.conda'
-        print(f"Process: Downloading file from URL: {url}")
-        file_name = f'{name}.conda'
-        response = requests.get(url)
-        if response.status_code != 200:
-            url = f'https://anaconda.org/conda-forge/{name}/{version}/download/{platform}/{dist_name}.tar.bz2'
-            print(f"Process: Downloading file from URL: {url}")
-            response = requests.get(url)
-            if response.status_code != 200:
-                print("Failure occurred. Exception handling initiated. Unable to download file.")
-                continue
-            file_name = f'{name}.tar.bz2'
-        with open(file_name, 'wb') as file:
-            file.write(response.content)
-        with open(file_name, 'rb') as file:
-            content = file.read()
+    failures = []
+    formats = dict.fromkeys(FORMATS, 0)
+
+    def process(link):
+        link_arches = arches[package_key(link)] if arches else ('x86_64',)
+        # Builds of one package for different platforms share a file name, so every platform
+        # keeps its files in its own subdirectory
+        link_dir = os.path.join(download_dir, link['platform']) if download_dir else None
+        download_metrics.start(link)
+        entry = journal.get(link) if journal else None
+        if entry and (not link_dir or os.path.exists(os.path.join(link_dir, entry['file_name']))):
+            download_metrics.finish('journal')
+            return entry['file_name'], make_source(entry['url'], entry['sha256'], entry['file_name'], link_arches)
         try:
-            sha256_hash = hashlib.sha256(content).hexdigest()
-        except Exception:
-            sha256_hash = "unknown"
-        sources.append({
-            '- type': 'file',
-            'only-arches': ' x86_64',
-            'url': url,
-            'sha256': sha256_hash,
-            'dest-filename': file_name
-        })
-        install.append(f' - install -Dm 755 -t $FLATPAK_DEST/download {file_name}')
-        mamba_install.append(f' - $FLATPAK_DEST/anaconda/bin/mamba install $FLATPAK_DEST/download/{file_name}')
-        os.remove(file_name)
-            
-    return install, mamba_install, sources
-
-def display_sources(install, mamba_install, sources):
+            if link_dir:
+                os.makedirs(link_dir, exist_ok=True)
+            result = download_package(session, link, base_url, link_dir, cache, metadata, link_arches)
+        except (DownloadError, OSError) as e:
+            download_metrics.finish('failed')
+            print(f"Failure occurred. Unable to process {link['dist_name']}: {e}")
+            if journal:
+                journal.record(link, 'failed', error=str(e))
+            return e
+        download_metrics.finish()
+        if journal:
+            file_name, source = result
+            journal.record(link, 'done', file_name=file_name, url=source['url'], sha256=source['sha256'])
+        return result
+
+    resumed = sum(1 for link in links if journal and journal.get(link))
+    print(f"Initiating process: Processing each link ({concurrency} concurrent downloads, {resumed} resumed from journal)")
+    download_metrics.begin(len(links), concurrency)
+    if progress_interval > 0:
+        download_metrics.start_reporter(progress_interval)
+    try:
+        # executor.map yields results in the order of links, so the output stays deterministic
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for link, result in zip(links, executor.map(process, links)):
+                if isinstance(result, Exception):
+                    failures.append((link, str(result)))
+                    continue
+                file_name, source = result
+                formats['.conda' if file_name.endswith('.conda') else '.tar.bz2'] += 1
+                sources.append(source)
+                # flatpak-builder only fetches the sources of the arch being built, so every command is
+                # skipped when its file is absent; packages of different platforms share one command
+                command = f'[ ! -e {file_name} ] || install -Dm 755 -t $FLATPAK_DEST/download {file_name}'
+                if command not in install:
+                    install.append(command)
+                    mamba_install.append(f'[ ! -e $FLATPAK_DEST/download/{file_name} ] || $FLATPAK_DEST/anaconda/bin/mamba install $FLATPAK_DEST/download/{file_name}')
+    finally:
+        download_metrics.stop_reporter()
+        # Whatever was finished before an interruption stays known to the next run
+        if cache:
+            cache.save()
+    print(download_metrics.progress_line())
+    print(f"Process: Formats chosen: {', '.join(f'{count} x {extension}' for extension, count in formats.items())}")
+
+    return install, mamba_install, sources, failures
+
+def print_failure_report(failures, journal_path=None):
     print("===========================================")
-    print("Initiating process: Displaying all sources")
+    print(f"Failure report: {len(failures)} packages need attention")
     print("===========================================")
-    for i in install:
-        print(i)
-    print("-------------------------------------------")
-    for i in mamba_install:
-        print(i)
-    print("-------------------------------------------")
-    for s in sources:
-        print(f"- type: {s['- type']}")
-        print(f"  only-arches:\n    -{s['only-arches']}")
-        print(f"  url: {s['url']}")
-        print(f"  sha256: {s['sha256']}")
-        print(f"  dest-filename: {s['dest-filename']}")
-    print("--------------------------------------------")
-    print(f"Date and time: {datetime.now()}")
-
-def write_output_to_file(install, mamba_install, sources):
-    with open(f"output_{datetime.now().strftime('%Y%m%d_%H%M')}.txt", "a") as file:
-        file.write("===========================================\n")
-        file.write("Initiating process: Displaying all sources\n")
-        file.write("===========================================\n")
-        for i in install:
-            file.write(i + "\n")
-        file.write("-------------------------------------------\n")
-        for i in mamba_install:
-            file.write(i + "\n")
-        file.write("-------------------------------------------\n")
-        for s in sources:
-            file.write(f"- type: {s['- type']}\n")
-            file.write(f"  only-arches:\n    -{s['only-arches']}\n")
-            file.write(f"  url: {s['url']}\n")
-            file.write(f"  sha256: {s['sha256']}\n")
-            file.write(f"  dest-filename: {s['dest-filename']}\n")
-        file.write("--------------------------------------------\n")
-        file.write(f"Date and time: {datetime.now()}\n")
+    for link, error in failures:
+        print(f" - {package_key(link)}: {error}")
+    if journal_path:
+        print(f"Rerun the same command to retry them, finished packages are resumed from {journal_path}")
+
+def build_module(name, install, mamba_install, sources):
+    # A flatpak-builder module that installs the packages into the conda environment of the app
+    return {
+        'name': name,
+        'buildsystem': 'simple',
+        'build-commands': install + mamba_install,
+        'sources': sources
+    }
+
+def format_yaml_scalar(value):
+    if value is None or isinstance(value, bool):
+        return json.dumps(value)
+    if isinstance(value, (int, float)):
+        return str(value)
+    if YAML_PLAIN_PATTERN.fullmatch(value) and value.lower() not in YAML_RESERVED:
+        return value
+    # A JSON string is also a valid double quoted YAML scalar
+    return json.dumps(value)
+
+def write_yaml(value, file, indent='', first_indent=None):
+    # Block style YAML written piece by piece, first_indent replaces the indent of the
+    # first line so mappings can start on the line of their list dash
+    first_indent = indent if first_indent is None else first_indent
+    if isinstance(value, dict):
+        for i, (key, item) in enumerate(value.items()):
+            lead = first_indent if i == 0 else indent
+            if isinstance(item, (dict, list)) and item:
+                file.write(f'{lead}{key}:\n')
+                write_yaml(item, file, indent + '  ')
+            elif isinstance(item, (dict, list)):
+                file.write(f'{lead}{key}: {json.dumps(item)}\n')
+            else:
+                file.write(f'{lead}{key}: {format_yaml_scalar(item)}\n')
+    else:
+        for i, item in enumerate(value):
+            lead = first_indent if i == 0 else indent
+            if isinstance(item, dict) and item:
+                write_yaml(item, file, indent + '  ', f'{lead}- ')
+            elif isinstance(item, (dict, list)):
+                file.write(f'{lead}- {json.dumps(item)}\n')
+            else:
+                file.write(f'{lead}- {format_yaml_scalar(item)}\n')
+
+def write_manifest(module, output, output_format, print_output=False):
+    print(f"Initiating process: Writing {len(module['sources'])} sources to {output}")
+    with open(output, 'w') as file:
+        if output_format == 'json':
+            # json.dump encodes the module in chunks straight into the file
+            json.dump(module, file, indent=4)
+            file.write('\n')
+        else:
+            file.write(f"# Generated by {os.path.basename(__file__)} on {datetime.now():%Y-%m-%d %H:%M}\n")
+            write_yaml(module, file)
+    if print_output:
+        with open(output, 'r') as file:
+            shutil.copyfileobj(file, sys.stdout)
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Generate flatpak sources for the packages of a conda environment")
+    parser.add_argument('specs', nargs='*', help=f"Conda package specs of the environment (default: {' '.join(DEFAULT_SPECS)})")
+    parser.add_argument('-c', '--channel', action='append', help=f"Channel to solve against, may be given several times (default: {' '.join(DEFAULT_CHANNELS)})")
+    parser.add_argument('-e', '--environment-file', help='Take specs and channels from an environment.yml (requires PyYAML)')
+    parser.add_argument('--solver', choices=sorted(SOLVER_COMMANDS), default='conda', help='Solver used to resolve the environment (default: conda)')
+    parser.add_argument('--solution', help='Use a recorded dry run solution instead of solving, {platform} in the path is replaced by the platform')
+    parser.add_argument('--refresh-solve', action='store_true', help='Solve again even if a cached solution exists')
+    parser.add_argument('-o', '--output', default='conda-packages.yml', help='flatpak-builder module file to write (default: conda-packages.yml)')
+    parser.add_argument('--format', choices=['yaml', 'json'], help='Format of the module file (default: from the --output extension, else yaml)')
+    parser.add_argument('--module-name', default='conda-packages', help='Name of the generated module (default: conda-packages)')
+    parser.add_argument('--print', action='store_true', help='Also print the module to stdout')
+    parser.add_argument('-p', '--platform', action='append', choices=sorted(PLATFORM_ARCHES), help='Conda platform to generate sources for, may be given several times (default: linux-64)')
+    parser.add_argument('-j', '--concurrency', type=int, default=8, help='Number of packages downloaded at the same time (default: 8)')
+    parser.add_argument('--timeout', type=float, nargs=2, default=DEFAULT_TIMEOUT, metavar=('CONNECT', 'READ'),
+                        help=f'Seconds to connect and seconds to wait for data before a request fails (default: {DEFAULT_TIMEOUT[0]} {DEFAULT_TIMEOUT[1]})')
+    parser.add_argument('--retries', type=int, default=3, help='Retries with exponential backoff for failed requests (default: 3)')
+    parser.add_argument('--download-dir', help='Keep the downloaded packages in a subdirectory per platform of this directory (by default they are only hashed in memory)')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help=f'Cache of package URLs and hashes (default: {DEFAULT_CACHE_DIR})')
+    parser.add_argument('--cache-packages', action='store_true', help='Also keep the package files in the cache')
+    parser.add_argument('--cache-max-size', type=int, default=2048, help='Maximum size of cached package files in MB (default: 2048)')
+    parser.add_argument('--no-cache', action='store_true', help='Solve, download and hash every package again')
+    parser.add_argument('--repodata-dir', help='Read repodata from <dir>/<channel>/<platform>/repodata.json instead of the channels')
+    parser.add_argument('--no-repodata', action='store_true', help='Ignore channel metadata and hash every package by downloading it')
+    parser.add_argument('--journal', help='Progress journal used to resume an interrupted run (default: <output>.journal)')
+    parser.add_argument('--no-resume', action='store_true', help='Start over instead of resuming from the journal')
+    parser.add_argument('--metrics', help='Write per-package download metrics and a summary as JSON to this file')
+    parser.add_argument('--progress-interval', type=float, default=2.0, help='Seconds between progress lines, 0 disables them (default: 2)')
+    parser.add_argument('--base-url', default=BASE_URL, help=f'Server the packages are downloaded from (default: {BASE_URL})')
+    return parser.parse_args()
 
 def main():
-    create_conda_env()
-    links = load_json_file()
-    install, mamba_install, sources = process_links(links)
-    display_sources(install, mamba_install, sources)
-    write_output_to_file(install, mamba_install, sources)
+    args = parse_arguments()
+    platforms = list(dict.fromkeys(args.platform or ['linux-64']))
+    specs, channels = list(args.specs), list(args.channel or [])
+    if args.environment_file:
+        file_specs, file_channels = load_environment_file(args.environment_file)
+        specs += file_specs
+        channels += file_channels
+    specs = list(dict.fromkeys(normalize_spec(spec) for spec in specs or DEFAULT_SPECS))
+    channels = list(dict.fromkeys(channels or DEFAULT_CHANNELS))
+    solutions = solve_platforms(platforms, specs, channels, args.solver, args.solution, None if args.no_cache else args.cache_dir, args.refresh_solve)
+    links, arches = merge_platform_links(solutions)
+    session = create_session(max(args.concurrency, 1), args.retries, tuple(args.timeout))
+    if args.download_dir:
+        os.makedirs(args.download_dir, exist_ok=True)
+    cache = None if args.no_cache else PackageCache(args.cache_dir, args.cache_max_size * 1024 * 1024, args.cache_packages)
+    metadata = None
+    if not args.no_repodata:
+        pending = [link for link in links if not (cache and cache.get(link))]
+        metadata = load_package_metadata(pending, session, max(args.concurrency, 1), None if args.no_cache else args.cache_dir, args.repodata_dir)
+    journal = Journal(args.journal or f'{args.output}.journal', not args.no_resume)
+    try:
+        install, mamba_install, sources, failures = process_links(links, session, args.base_url.rstrip('/'), max(args.concurrency, 1), args.download_dir, cache, metadata, arches, journal, args.progress_interval)
+    finally:
+        journal.close()
+        if args.metrics:
+            download_metrics.write(args.metrics)
+    output_format = args.format or OUTPUT_FORMATS.get(os.path.splitext(args.output)[1].lower(), 'yaml')
+    write_manifest(build_module(args.module_name, install, mamba_install, sources), args.output, output_format, args.print)
+    if failures:
+        print_failure_report(failures, journal.path)
+        sys.exit(1)
+    # Everything is done, the next run starts from a clean journal
+    os.remove(journal.path)
 
 if __name__ == "__main__":
     main()
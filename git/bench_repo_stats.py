@@ -0,0 +1,80 @@
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from git import Repo
+from repo_stats import BACKENDS, iter_repo_commits
+
+AUTHORS = [f'Author {i}' for i in range(20)]
+
+def create_synthetic_repo(path, commits):
+    # git fast-import builds the whole history in one process, far faster than committing one by one
+    print(f"Initiating process: Creating a synthetic repository with {commits} commits in {path}")
+    subprocess.run(['git', 'init', '-q', '--bare', '-b', 'master', path], check=True)
+    process = subprocess.Popen(['git', 'fast-import', '--quiet'], cwd=path, stdin=subprocess.PIPE)
+    timestamp = 1500000000
+    for i in range(commits):
+        author = AUTHORS[i % len(AUTHORS)]
+        message = f'Change number {i}\n\nBody of change {i}, touching file{i % 100}.txt\n'.encode()
+        content = f'{i}\n'.encode()
+        lines = [
+            b'commit refs/heads/master',
+            f'author {author} <{author.replace(" ", ".").lower()}@example.com> {timestamp + i * 600} +0000'.encode(),
+            f'committer {author} <{author.replace(" ", ".").lower()}@example.com> {timestamp + i * 600} +0000'.encode(),
+            f'data {len(message)}'.encode(), message,
+            f'M 644 inline file{i % 100}.txt'.encode(),
+            f'data {len(content)}'.encode(), content
+        ]
+        process.stdin.write(b'\n'.join(lines))
+    process.stdin.close()
+    if process.wait():
+        raise Exception("git fast-import failed")
+
+def run_backend(repo, backend, memory=False):
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    count = 0
+    digest = 0
+    for commit in iter_repo_commits(repo, backend=backend):
+        count += 1
+        # Touch every field, so lazily loaded backends pay for what they would be used for
+        digest ^= hash((commit.sha, commit.title, commit.message, commit.author, commit.timestamp))
+    seconds = time.perf_counter() - start
+    peak = None
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return count, seconds, digest, peak
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the commit backends of repo_stats on a synthetic repository")
+    parser.add_argument('-n', '--commits', type=int, default=100000, help='Number of commits of the synthetic repository (default: 100000)')
+    parser.add_argument('--repo', help='Benchmark this repository instead, it is created first if it does not exist')
+    parser.add_argument('--backend', action='append', choices=sorted(BACKENDS), help='Backend to benchmark, may be given several times (default: all)')
+    parser.add_argument('--memory', action='store_true', help='Also measure peak Python memory (slows every backend down)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = args.repo or os.path.join(temp_dir, 'synthetic.git')
+        if not os.path.exists(path):
+            start = time.perf_counter()
+            create_synthetic_repo(path, args.commits)
+            print(f"Process: Repository created in {time.perf_counter() - start:.1f}s")
+        repo = Repo(path)
+        results = {}
+        for backend in args.backend or list(BACKENDS):
+            print(f"Initiating process: Reading all commits with the {backend} backend")
+            count, seconds, digest, peak = run_backend(repo, backend, args.memory)
+            results[backend] = digest
+            line = f"{backend:>10}: {count} commits in {seconds:.2f}s ({count / seconds:,.0f} commits/s)"
+            if peak is not None:
+                line += f", peak memory {peak / (1024 * 1024):.1f} MB"
+            print(line)
+        if len(set(results.values())) > 1:
+            print("Failure occurred. The backends returned different commits.")
+
+if __name__ == "__main__":
+    main()
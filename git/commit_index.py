@@ -0,0 +1,133 @@
+import itertools
+import os
+import sqlite3
+import threading
+import time
+from git import GitCommandError
+from repo_stats import DEFAULT_CACHE_DIR, COMMIT_LOG_MODE, CommitRecord, open_mirror, iter_repo_commits
+
+DEFAULT_INDEX_PATH = os.path.join(DEFAULT_CACHE_DIR, 'commits.sqlite3')
+# Commits are inserted in batches of this size, so an update never holds a whole history in memory
+BATCH_SIZE = 5000
+
+class CommitIndex:
+    # Commit metadata of every indexed repository keyed by (repo, sha), together with the head
+    # each repository was indexed at, so an update only has to walk the commits added since.
+    # One connection is shared by all threads, its use is serialized by a lock.
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.executescript('''
+                CREATE TABLE IF NOT EXISTS commits (
+                    repo TEXT NOT NULL,
+                    sha TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    message TEXT NOT NULL,
+                    author TEXT NOT NULL,
+                    timestamp INTEGER NOT NULL,
+                    PRIMARY KEY (repo, sha)
+                );
+                CREATE INDEX IF NOT EXISTS commits_by_time ON commits (repo, timestamp);
+                CREATE INDEX IF NOT EXISTS commits_by_author ON commits (author);
+                CREATE TABLE IF NOT EXISTS staged_commits (
+                    repo TEXT NOT NULL,
+                    sha TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    message TEXT NOT NULL,
+                    author TEXT NOT NULL,
+                    timestamp INTEGER NOT NULL,
+                    PRIMARY KEY (repo, sha)
+                );
+                CREATE TABLE IF NOT EXISTS repos (
+                    repo TEXT PRIMARY KEY,
+                    head TEXT NOT NULL,
+                    updated REAL NOT NULL
+                );
+            ''')
+
+    def get_head(self, repo):
+        with self.lock:
+            row = self.connection.execute('SELECT head FROM repos WHERE repo = ?', (repo,)).fetchone()
+        return row[0] if row else None
+
+    def store_commits(self, repo, commits, head, replace=False):
+        # Commits are read outside the lock and written in one short transaction per batch, so
+        # the walks of several repositories run in parallel. The head is stored last, so an
+        # interrupted update is simply repeated by the next one. replace drops the stored history
+        # of the repo, for branches that were rewritten: the new history is written to staged_commits
+        # and moved over together with the head, so queries never see it half written.
+        table = 'staged_commits' if replace else 'commits'
+        if replace:
+            with self.lock, self.connection:
+                self.connection.execute('DELETE FROM staged_commits WHERE repo = ?', (repo,))
+        added = 0
+        commits = iter(commits)
+        while True:
+            batch = [(repo, commit.sha, commit.title, commit.message, commit.author, commit.timestamp)
+                     for commit in itertools.islice(commits, BATCH_SIZE)]
+            if not batch:
+                break
+            with self.lock, self.connection:
+                self.connection.executemany(f'INSERT OR IGNORE INTO {table} VALUES (?, ?, ?, ?, ?, ?)', batch)
+            added += len(batch)
+        with self.lock, self.connection:
+            if replace:
+                self.connection.execute('DELETE FROM commits WHERE repo = ?', (repo,))
+                self.connection.execute('INSERT OR IGNORE INTO commits SELECT * FROM staged_commits WHERE repo = ?', (repo,))
+                self.connection.execute('DELETE FROM staged_commits WHERE repo = ?', (repo,))
+            self.connection.execute('INSERT OR REPLACE INTO repos VALUES (?, ?, ?)', (repo, head, time.time()))
+        return added
+
+    def query(self, sql, parameters=()):
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    @staticmethod
+    def repo_filter(repo, prefix='WHERE'):
+        return (f'{prefix} repo = ?', (repo,)) if repo else ('', ())
+
+    def count_per_month(self, repo=None):
+        where, parameters = self.repo_filter(repo)
+        return self.query(f"SELECT strftime('%Y-%m', timestamp, 'unixepoch') AS month, COUNT(*) FROM commits {where} GROUP BY month ORDER BY month", parameters)
+
+    def count_per_author(self, repo=None, limit=None):
+        where, parameters = self.repo_filter(repo)
+        limit_clause = f'LIMIT {int(limit)}' if limit else ''
+        return self.query(f'SELECT author, COUNT(*) AS count FROM commits {where} GROUP BY author ORDER BY count DESC, author {limit_clause}', parameters)
+
+    def search(self, keyword, repo=None, limit=50):
+        # Case-insensitive substring match on the whole message, newest commits first
+        where, parameters = self.repo_filter(repo, 'AND')
+        pattern = '%' + keyword.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        rows = self.query(
+            f"SELECT repo, sha, title, message, author, timestamp FROM commits WHERE message LIKE ? ESCAPE '\\' {where} ORDER BY timestamp DESC LIMIT ?",
+            (pattern, *parameters, limit)
+        )
+        return [(row[0], CommitRecord(*row[1:])) for row in rows]
+
+    def repos(self):
+        return self.query('SELECT repos.repo, head, updated, COUNT(sha) FROM repos LEFT JOIN commits USING (repo) GROUP BY repos.repo ORDER BY repos.repo')
+
+    def close(self):
+        self.connection.close()
+
+def update_index(index, repo_url, branch='HEAD', **mirror_options):
+    # Fetch the mirror of repo_url and add the commits that are not indexed yet, returns their number
+    repo = open_mirror(repo_url, mode=mirror_options.pop('mode', COMMIT_LOG_MODE), **mirror_options)
+    head = repo.git.rev_parse(branch)
+    indexed_head = index.get_head(repo_url)
+    if indexed_head == head:
+        return 0
+    incremental = False
+    try:
+        # Only the commits added since the last update, unless the branch was rewritten
+        incremental = bool(indexed_head) and repo.is_ancestor(indexed_head, head)
+    except GitCommandError:
+        pass
+    if incremental:
+        return index.store_commits(repo_url, iter_repo_commits(repo, f'{indexed_head}..{head}'), head)
+    # A rewritten history replaces the stored one, so discarded commits are not counted any more;
+    # on the first update there is nothing to replace
+    return index.store_commits(repo_url, iter_repo_commits(repo, branch), head, replace=bool(indexed_head))
@@ -1,7 +1,97 @@
-from repo_stats import repo_stats
+import argparse
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from commit_index import DEFAULT_INDEX_PATH, CommitIndex, update_index
+from repo_stats import DEFAULT_CACHE_DIR, evict_mirrors, iter_commits
 
-for commit in repo_stats("https://gitlab.gnome.org/GNOME/connections"):
-    print("Title: ", commit['title'])
-    print("Message: ", commit['message'])
-    print("Date: ", commit['date'])
+DEFAULT_REPO = "https://gitlab.gnome.org/GNOME/connections"
 
+def print_commits(repo_url):
+    # Commits are printed as they are read instead of after the whole history is loaded
+    for commit in iter_commits(repo_url):
+        print("Title: ", commit['title'])
+        print("Message: ", commit['message'])
+        print("Date: ", commit['date'])
+
+def read_repo_list(path):
+    # One url per line, empty lines and lines starting with # are skipped
+    with open(path, 'r') as file:
+        return [line.strip() for line in file if line.strip() and not line.strip().startswith('#')]
+
+def update_repos(index, repo_urls, jobs, branch, cache_dir):
+    # Mirrors are fetched and walked in parallel, the index serializes the writes
+    failures = 0
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(update_index, index, repo_url, branch, cache_dir=cache_dir, evict=False): repo_url for repo_url in repo_urls}
+        for future in as_completed(futures):
+            try:
+                print(f"Process: {futures[future]}: {future.result()} new commits indexed")
+            except Exception as e:
+                failures += 1
+                print(f"Failure occurred. Unable to index {futures[future]}: {e}")
+    # No mirror is in use any more, so the cache can be trimmed safely
+    if os.path.isdir(cache_dir):
+        evict_mirrors(cache_dir)
+    return failures
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Commit statistics of git repositories")
+    parser.add_argument('repos', nargs='*', help='Urls of the repositories to index')
+    parser.add_argument('-f', '--file', help='File with one repository url per line to index')
+    parser.add_argument('-j', '--jobs', type=int, default=4, help='Number of repositories fetched at the same time (default: 4)')
+    parser.add_argument('-b', '--branch', default='HEAD', help='Branch to index (default: the default branch of every remote)')
+    parser.add_argument('--index', default=DEFAULT_INDEX_PATH, help=f'SQLite commit index (default: {DEFAULT_INDEX_PATH})')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help=f'Directory of the repository mirrors (default: {DEFAULT_CACHE_DIR})')
+    parser.add_argument('--repo', help='Only answer the queries for this repository url')
+    parser.add_argument('--per-month', action='store_true', help='Print the number of commits per month')
+    parser.add_argument('--per-author', action='store_true', help='Print the number of commits per author')
+    parser.add_argument('--top', type=int, help='Only print this many authors')
+    parser.add_argument('--search', help='Print the commits whose message contains this text')
+    parser.add_argument('--list', action='store_true', help='Print the indexed repositories')
+    parser.add_argument('--log', action='store_true', help=f'Print every commit of the repositories (or of {DEFAULT_REPO}) without indexing them')
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    repo_urls = list(args.repos)
+    if args.file:
+        repo_urls += read_repo_list(args.file)
+    repo_urls = list(dict.fromkeys(repo_urls))
+    queries = args.per_month or args.per_author or args.search or args.list
+
+    # Without repositories or queries the script prints the log of the default repository as it always did
+    if args.log or not (repo_urls or queries):
+        for repo_url in repo_urls or [DEFAULT_REPO]:
+            print_commits(repo_url)
+        return
+
+    index = CommitIndex(args.index)
+    failures = 0
+    try:
+        if repo_urls:
+            print(f"Initiating process: Indexing {len(repo_urls)} repositories ({args.jobs} at a time)")
+            failures = update_repos(index, repo_urls, max(args.jobs, 1), args.branch, args.cache_dir)
+        if args.list:
+            print("Indexed repositories:")
+            for repo, head, updated, count in index.repos():
+                print(f"  {repo}: {count} commits, head {head[:12]}")
+        if args.per_month:
+            print("Commits per month:")
+            for month, count in index.count_per_month(args.repo):
+                print(f"  {month}: {count}")
+        if args.per_author:
+            print("Commits per author:")
+            for author, count in index.count_per_author(args.repo, args.top):
+                print(f"  {author}: {count}")
+        if args.search:
+            print(f"Commits mentioning {args.search!r}:")
+            for repo, commit in index.search(args.search, args.repo):
+                print(f"  {commit.date} {repo} {commit.sha[:12]} {commit.title}")
+    finally:
+        index.close()
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -2,28 +2,188 @@ import git
 from git import Repo
 import os
 import shutil
+import hashlib
+import time
+import uuid
 import datetime
 
-def repo_stats(repo_url):
-    # Get directory name from the link
-    directory_name = repo_url.split('/')[-1]
-    # If the directory already exists, append what was previously from the url to the name
-    if os.path.exists(directory_name):
-        directory_name += repo_url.split('/')[-2]
-    # If the name is still taken, write that you cannot perform the operation due to project collisions
-    if os.path.exists(directory_name):
-        raise Exception("Could not perform operation due to project collisions")
-    # Check if the specified location is a git repository, if so, do not download
-    if not os.path.exists(f'{directory_name}/.git'):
-        repo = Repo.clone_from(repo_url, directory_name)
+# Bare mirrors of the queried repositories are kept here and only fetched on later queries
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'repo_stats')
+DEFAULT_MAX_SIZE = 2 * 1024 * 1024 * 1024
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60
+# git clone options of every acquisition mode, none of them writes a working tree
+CLONE_MODES = {
+    'bare': ['--mirror'],
+    'blobless': ['--mirror', '--filter=blob:none'],
+    'treeless': ['--mirror', '--filter=tree:0'],
+    'no-checkout': ['--no-checkout', '--filter=blob:none']
+}
+# Commit logs need commits and trees (for path filters) but never file contents
+COMMIT_LOG_MODE = 'blobless'
+# One git log record per commit: fields separated by \x1f, records terminated by \x1e
+LOG_FORMAT = '%H%x1f%an%x1f%ct%x1f%B%x1e'
+LOG_CHUNK_SIZE = 1024 * 1024
+# Touched on every use of a mirror, its modification time drives the eviction
+USED_MARKER = 'repo_stats_used'
+
+class CommitRecord:
+    # Compact record of a single commit. Indexing by field name keeps it usable wherever the
+    # dicts returned by earlier versions of repo_stats were used.
+    __slots__ = ('sha', 'title', 'message', 'author', 'timestamp')
+
+    def __init__(self, sha, title, message, author, timestamp):
+        self.sha = sha
+        self.title = title
+        self.message = message
+        self.author = author
+        self.timestamp = timestamp
+
+    @property
+    def date(self):
+        return datetime.datetime.fromtimestamp(self.timestamp).strftime('%Y:%m:%d')
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __repr__(self):
+        return f"CommitRecord({self.sha[:12]}, {self.title!r}, {self.date})"
+
+def format_date(value):
+    return value.isoformat() if isinstance(value, (datetime.date, datetime.datetime)) else value
+
+def get_mirror_path(repo_url, cache_dir, mode='bare', since=None, depth=None):
+    # The readable project name keeps the cache browsable, the hash of the url and of the
+    # acquisition options keeps it unique, so a shallow mirror never answers a full query
+    name = repo_url.rstrip('/').split('/')[-1].removesuffix('.git') or 'repo'
+    key = repo_url if (mode, since, depth) == ('bare', None, None) else f'{repo_url}|{mode}|{since}|{depth}'
+    return os.path.join(cache_dir, f"{name}-{hashlib.sha1(key.encode()).hexdigest()[:12]}.git")
+
+def get_history_options(since=None, depth=None):
+    options = []
+    if since:
+        options.append(f'--shallow-since={format_date(since)}')
+    if depth:
+        options.append(f'--depth={depth}')
+    return options
+
+def get_directory_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                size += os.path.getsize(os.path.join(root, file))
+            except OSError:
+                pass
+    return size
+
+def get_last_used(path):
+    try:
+        return os.path.getmtime(os.path.join(path, USED_MARKER))
+    except OSError:
+        return os.path.getmtime(path)
+
+def evict_mirrors(cache_dir, max_size=DEFAULT_MAX_SIZE, max_age=DEFAULT_MAX_AGE, keep=None):
+    # First drop mirrors that have not been used for max_age seconds, then the least recently
+    # used ones until the cache fits in max_size bytes. The mirror in use is never removed.
+    mirrors = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith('.git')]
+    mirrors = sorted((get_last_used(path), path) for path in mirrors if path != keep)
+    now = time.time()
+    sizes = {path: get_directory_size(path) for _, path in mirrors}
+    total = sum(sizes.values()) + (get_directory_size(keep) if keep else 0)
+    for last_used, path in mirrors:
+        if now - last_used > max_age or total > max_size:
+            shutil.rmtree(path, ignore_errors=True)
+            total -= sizes[path]
+
+def open_mirror(repo_url, cache_dir=DEFAULT_CACHE_DIR, max_size=DEFAULT_MAX_SIZE, max_age=DEFAULT_MAX_AGE, mode='bare', since=None, depth=None, evict=True):
+    if mode not in CLONE_MODES:
+        raise ValueError(f"Unknown clone mode {mode}, expected one of {', '.join(CLONE_MODES)}")
+    os.makedirs(cache_dir, exist_ok=True)
+    path = get_mirror_path(repo_url, cache_dir, mode, since, depth)
+    history_options = get_history_options(since, depth)
+    if os.path.exists(path):
+        # Only the objects that are new since the last query are transferred, the partial clone
+        # filter is remembered by the repository and applies to the fetch as well
+        repo = Repo(path)
+        if mode == 'no-checkout':
+            # Branches are not mirrored here, so they are updated from the remote explicitly
+            repo.git.fetch('--prune', '--update-head-ok', *history_options, 'origin', '+refs/heads/*:refs/heads/*')
+        else:
+            repo.git.fetch('--prune', *history_options, 'origin')
     else:
-        repo = Repo(directory_name)
-
-    # Then return a list of commits along with their messages, titles and dates
-    commits = list(repo.iter_commits('master'))
-    commit_data = [{'title': commit.summary, 'message': commit.message, 'date': datetime.datetime.fromtimestamp(commit.committed_date).strftime('%Y:%m:%d')} for commit in commits]
-    
-    # After finishing work, delete the folder even if it is not empty.
-    shutil.rmtree(directory_name)
-    
-    return commit_data
+        # Clone next to the final location and move it in place, so an interrupted clone never looks like a mirror
+        temp_path = os.path.join(cache_dir, f'.clone-{uuid.uuid4().hex[:8]}')
+        try:
+            Repo.clone_from(repo_url, temp_path, multi_options=CLONE_MODES[mode] + history_options)
+            os.replace(temp_path, path)
+        finally:
+            shutil.rmtree(temp_path, ignore_errors=True)
+        repo = Repo(path)
+    with open(os.path.join(path, USED_MARKER), 'w'):
+        pass
+    # Callers using several mirrors at once pass evict=False and evict once they are done,
+    # eviction here could remove a mirror another thread is still reading
+    if evict:
+        evict_mirrors(cache_dir, max_size, max_age, keep=path)
+    return repo
+
+def parse_log_record(record):
+    sha, author, timestamp, message = record.decode('utf-8', 'replace').split('\x1f', 3)
+    return CommitRecord(sha, message.split('\n', 1)[0], message, author, int(timestamp))
+
+def iter_log(repo, branch='HEAD', options=None, paths=None):
+    # A single git log streams the metadata of every commit; records are parsed as soon as
+    # they are complete, a record may span several chunks of the stream
+    arguments = [branch, '--', *paths] if paths else [branch]
+    process = repo.git.log(*arguments, format=LOG_FORMAT, as_process=True, **(options or {}))
+    pending = b''
+    for chunk in iter(lambda: process.stdout.read(LOG_CHUNK_SIZE), b''):
+        records = (pending + chunk).split(b'\x1e')
+        pending = records.pop()
+        for record in records:
+            # tformat ends every record with a newline, which is left at the start of the next one
+            record = record.lstrip(b'\n')
+            if record:
+                yield parse_log_record(record)
+    process.wait()
+
+def iter_gitpython(repo, branch='HEAD', options=None, paths=None):
+    # Reads every commit object through GitPython, kept to compare against the git log backend
+    for commit in repo.iter_commits(branch, paths=paths or '', **(options or {})):
+        yield CommitRecord(commit.hexsha, commit.summary, commit.message, commit.author.name, commit.committed_date)
+
+BACKENDS = {
+    'log': iter_log,
+    'gitpython': iter_gitpython
+}
+
+def iter_repo_commits(repo, branch='HEAD', since=None, until=None, author=None, paths=None, backend='log'):
+    # Yield the commits of an already opened repository, see iter_commits
+    options = {}
+    if since:
+        options['since'] = format_date(since)
+    if until:
+        options['until'] = format_date(until)
+    if author:
+        options['author'] = author
+    if isinstance(paths, str):
+        paths = [paths]
+    return BACKENDS[backend](repo, branch, options, paths)
+
+def iter_commits(repo_url, branch='HEAD', since=None, until=None, author=None, paths=None, cache_dir=DEFAULT_CACHE_DIR,
+                 max_size=DEFAULT_MAX_SIZE, max_age=DEFAULT_MAX_AGE, mode='auto', shallow_since=None, depth=None, backend='log'):
+    # Yield the commits of branch (by default the default branch of the remote) newest first, one at
+    # a time as git lists them, so memory use does not grow with the length of the history.
+    # since/until limit the commit dates, author is a pattern matched by git and paths limits the
+    # log to commits touching them. shallow_since and depth limit what is fetched at all.
+    # Only commit metadata is read, so by default no file contents are transferred
+    repo = open_mirror(repo_url, cache_dir, max_size, max_age, COMMIT_LOG_MODE if mode == 'auto' else mode, shallow_since, depth)
+    yield from iter_repo_commits(repo, branch, since, until, author, paths, backend)
+
+def repo_stats(repo_url, branch='HEAD', **options):
+    # Return a list of commits along with their messages, titles and dates, for callers that
+    # want the whole history at once; options are those of iter_commits
+    return list(iter_commits(repo_url, branch, **options))
@@ -7,16 +7,26 @@ installing current dependencies, and updating them to their latest versions.
 It creates backups of the original files and can show diffs between versions.
 """
 import os
+import re
 import sys
+import json
 import shutil
 import subprocess
-import glob
+import fnmatch
 import argparse
 import atexit
 import uuid
 import time
+import hashlib
+import platform
+import threading
+from contextlib import contextmanager
+import urllib.parse
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from typing import Dict, List, Optional, Any, Tuple, Set
+from typing import Dict, List, Optional, Any, Tuple, Set, Iterator, Iterable
 
 
 # ANSI color codes (standard terminal colors)
@@ -54,6 +64,290 @@ def color_text(text: str, color_code: str) -> str:
 all_backup_files = []
 # List to track all temporary directories
 temp_directories = []
+# Lock guarding the tracking lists when files are updated in parallel
+tracking_lock = threading.Lock()
+# Per-thread output buffer, so logs of parallel updates do not interleave
+thread_output = threading.local()
+# Default location and size limit (in MB) of the shared virtualenv cache
+DEFAULT_CACHE_DIR = os.path.join(".tmp", "venv_cache")
+DEFAULT_CACHE_MAX_SIZE = 5120
+# Default JSON API used to look up the latest versions in resolve-only mode
+DEFAULT_INDEX_URL = "https://pypi.org/pypi"
+# Number of concurrent index metadata requests per requirements file
+INDEX_WORKERS = 8
+# PEP 440 version pattern (epoch, release, pre, post, dev, local)
+VERSION_PATTERN = re.compile(
+    r"^\s*v?(?:(\d+)!)?(\d+(?:\.\d+)*)"
+    r"(?:[-_.]?(a|b|c|rc|alpha|beta|pre|preview)[-_.]?(\d*))?"
+    r"(?:-(\d+)|[-_.]?(?:post|rev|r)[-_.]?(\d*))?"
+    r"(?:[-_.]?dev[-_.]?(\d*))?"
+    r"(?:\+[a-z0-9]+(?:[-_.][a-z0-9]+)*)?\s*$",
+    re.IGNORECASE
+)
+# Regexes used by the requirements parser
+COMMENT_PATTERN = re.compile(r"(^|\s+)#.*$")
+HASH_PATTERN = re.compile(r"--hash[=\s]\s*([A-Za-z0-9]+:[A-Fa-f0-9]+)")
+REQUIREMENT_PATTERN = re.compile(
+    r"^\s*(?P<name>[A-Za-z0-9](?:[A-Za-z0-9._-]*[A-Za-z0-9])?)\s*"
+    r"(?P<extras>\[[^\]]*\])?\s*"
+    r"(?:@\s*(?P<url>[^\s;]+)\s*|(?P<specifier>[^;@]*?))\s*"
+    r"(?:;\s*(?P<marker>.*?))?\s*$"
+)
+SPECIFIER_PATTERN = re.compile(r"^\(?\s*(?:(?:~=|===|==|!=|<=|>=|<|>)\s*[^,;\s()]+\s*,?\s*)*\)?$")
+# Options that pull in other requirement files
+INCLUDE_OPTIONS = {"-r": "include", "--requirement": "include", "-c": "constraint", "--constraint": "constraint"}
+# Parsed files by absolute path, with the (mtime, size) they were parsed at
+parsed_files_cache: Dict[str, Tuple[Tuple[int, int], "RequirementsFile"]] = {}
+parsed_files_lock = threading.RLock()
+# Latest releases looked up during this run, keyed by (index URL, package name)
+latest_release_cache: Dict[Tuple[str, str], Dict[str, Any]] = {}
+# Default location of the incremental mode state file
+DEFAULT_STATE_FILE = os.path.join(".tmp", "update_state.json")
+# Directories never searched for requirements files
+DEFAULT_EXCLUDES = [
+    ".git", ".hg", ".svn", ".tmp", "node_modules", "__pycache__", "site-packages",
+    ".venv", "venv", ".tox", ".nox", ".mypy_cache", ".pytest_cache", ".ruff_cache"
+]
+# Names of requirements files, e.g. requirements.txt, requirements-dev.txt, requirements.in
+REQUIREMENTS_FILE_PATTERN = re.compile(r"^requirements(?:[-_.][\w.-]+)?\.(?:txt|in)$")
+# Backups created by this script, which must not be picked up as requirements files
+BACKUP_FILE_PATTERN = re.compile(r"_backup_\d{8}_\d{6}\.\w+$")
+# Number of subprocess output lines kept per file and shown if the file fails
+DEFAULT_LOG_TAIL = 200
+# Subprocess output lines that are shown live even without --verbose
+PROGRESS_LINE_PATTERN = re.compile(r"^(Collecting|Installing collected packages|Successfully installed|ERROR:)")
+# Locks serializing the build of each cache entry and the eviction pass
+cache_locks: Dict[str, threading.Lock] = {}
+cache_lock = threading.Lock()
+
+
+class TimingReport:
+    """
+    Collects timing spans of the phases of a run (venv creation, installs, upgrades, ...)
+    
+    Spans are attributed to the requirements file the current thread is working on,
+    so per-file and per-run totals can be computed even when files run in parallel.
+    
+    Attributes:
+        spans: Recorded spans as dictionaries with file, phase, start offset and duration
+    """
+    
+    def __init__(self):
+        self.spans: List[Dict[str, Any]] = []
+        self.lock = threading.Lock()
+        self.started_at = datetime.now()
+        self.start_time = time.monotonic()
+    
+    @contextmanager
+    def span(self, phase: str, file: Optional[str] = None, **attributes: Any) -> Iterator[None]:
+        """
+        Time the enclosed block as one phase
+        
+        Args:
+            phase: Name of the phase, e.g. "venv_create"
+            file: Requirements file the phase belongs to, defaults to the current thread's file
+            **attributes: Additional values stored with the span, e.g. the package name
+        """
+        start_time = time.monotonic()
+        status = "ok"
+        try:
+            yield
+        except BaseException:
+            status = "failed"
+            raise
+        finally:
+            span = {
+                "file": file or getattr(thread_output, "file", None),
+                "phase": phase,
+                "start": round(start_time - self.start_time, 6),
+                "duration": round(time.monotonic() - start_time, 6),
+                "status": status
+            }
+            span.update(attributes)
+            with self.lock:
+                self.spans.append(span)
+    
+    @staticmethod
+    def get_phase_totals(spans: List[Dict[str, Any]]) -> Dict[str, float]:
+        """
+        Sum span durations per phase
+        
+        Args:
+            spans: The spans to sum
+            
+        Returns:
+            Dictionary mapping phase names to total seconds
+        """
+        totals: Dict[str, float] = {}
+        for span in spans:
+            totals[span["phase"]] = round(totals.get(span["phase"], 0.0) + span["duration"], 6)
+        return totals
+    
+    def write(self, path: str, outcomes: List[Dict[str, Any]], report_format: str = "json") -> None:
+        """
+        Write the report with per-file and per-run totals
+        
+        The "json" format writes one document; "ndjson" writes one line per span, one per
+        file and a final line for the whole run, which is convenient for log shippers.
+        
+        Args:
+            path: Destination path
+            outcomes: Outcomes as returned by process_files
+            report_format: Either "json" or "ndjson"
+        """
+        with self.lock:
+            spans = list(self.spans)
+        
+        files = []
+        for outcome in outcomes:
+            file_spans = [span for span in spans if span["file"] == outcome["file"]]
+            files.append({
+                "file": outcome["file"],
+                "status": outcome["status"],
+                "error": outcome["error"],
+                "duration": round(outcome["duration"], 6),
+                "phases": self.get_phase_totals(file_spans),
+                "changes": outcome.get("changes"),
+                "spans": file_spans
+            })
+        
+        run = {
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "duration": round(time.monotonic() - self.start_time, 6),
+            "python": platform.python_version(),
+            "files": len(outcomes),
+            "statuses": {status: sum(1 for outcome in outcomes if outcome["status"] == status)
+                         for status in sorted({outcome["status"] for outcome in outcomes})},
+            "phases": self.get_phase_totals(spans)
+        }
+        
+        with open(path, 'w') as f:
+            if report_format == "ndjson":
+                for span in spans:
+                    f.write(json.dumps({"type": "span", **span}) + "\n")
+                for file_report in files:
+                    file_report = {key: value for key, value in file_report.items() if key != "spans"}
+                    f.write(json.dumps({"type": "file", **file_report}) + "\n")
+                f.write(json.dumps({"type": "run", **run}) + "\n")
+            else:
+                json.dump({"run": run, "files": files}, f, indent=2)
+
+
+# Timing spans of the current run
+timing_report = TimingReport()
+
+
+def log(text: str = "") -> None:
+    """
+    Print a line of output, or append it to the current thread's buffer
+
+    Args:
+        text: The text to output
+    """
+    buffer = getattr(thread_output, "buffer", None)
+    if buffer is None:
+        print(text)
+    else:
+        buffer.append(text)
+
+
+class CommandRunner:
+    """
+    Runs subprocesses while streaming their output into a bounded ring buffer
+    
+    stdout and stderr are read line by line as they are produced, so memory stays flat
+    however verbose a command is. Only progress lines (and everything in verbose mode)
+    are emitted live; the last lines of a file's output are kept in a per-file ring
+    buffer that process_file dumps if the file fails.
+    
+    Attributes:
+        verbose: Whether to emit every output line instead of progress lines only
+        tail_lines: Number of output lines kept per requirements file
+    """
+    
+    def __init__(self, verbose: bool = False, tail_lines: int = DEFAULT_LOG_TAIL):
+        self.verbose = verbose
+        self.tail_lines = tail_lines
+    
+    def get_tail(self) -> deque:
+        """Get the current thread's ring buffer, creating one if needed"""
+        tail = getattr(thread_output, "tail", None)
+        if tail is None:
+            tail = thread_output.tail = deque(maxlen=self.tail_lines)
+        return tail
+    
+    def consume(self, stream: Any, tail: deque, prefix: str, collected: Optional[List[str]] = None) -> None:
+        """
+        Read a stream of the subprocess until it is closed
+        
+        Args:
+            stream: The stdout or stderr pipe
+            tail: Ring buffer receiving the output lines
+            prefix: Text prepended to lines emitted live
+            collected: List receiving the raw lines instead, for output that is parsed
+        """
+        for line in stream:
+            if collected is not None:
+                collected.append(line)
+                continue
+            line = line.rstrip()
+            tail.append(line)
+            if self.verbose or PROGRESS_LINE_PATTERN.match(line):
+                print(f"{prefix}{line}")
+        stream.close()
+    
+    def run(self, command: List[str], check: bool = False, capture: bool = False) -> subprocess.CompletedProcess:
+        """
+        Run a subprocess and stream its output
+        
+        Args:
+            command: The command and its arguments
+            check: Whether to raise CalledProcessError on a non-zero exit code
+            capture: Whether to return stdout in full (e.g. pip freeze) instead of logging it
+            
+        Returns:
+            The completed process, with stdout set if capture is True
+        """
+        tail = self.get_tail()
+        # Parallel workers prefix live lines with their file, as their log is only printed at the end
+        buffered = getattr(thread_output, "buffer", None) is not None
+        prefix = f"[{thread_output.file}] " if buffered and getattr(thread_output, "file", None) else ""
+        tail.append(f"$ {' '.join(command)}")
+        
+        process = subprocess.Popen(
+            command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL,
+            text=True, errors="replace", bufsize=1
+        )
+        collected: Optional[List[str]] = [] if capture else None
+        stderr_reader = threading.Thread(target=self.consume, args=(process.stderr, tail, prefix), daemon=True)
+        stderr_reader.start()
+        self.consume(process.stdout, tail, prefix, collected)
+        stderr_reader.join()
+        returncode = process.wait()
+        
+        stdout = "".join(collected) if collected is not None else None
+        if check and returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command, output=stdout)
+        return subprocess.CompletedProcess(command, returncode, stdout=stdout)
+
+
+# Runner used for all subprocesses, configured from the command line in main()
+command_runner = CommandRunner()
+
+
+def run_command(command: List[str], check: bool = False, capture: bool = False) -> subprocess.CompletedProcess:
+    """
+    Run a subprocess through the shared command runner
+    
+    Args:
+        command: The command and its arguments
+        check: Whether to raise CalledProcessError on a non-zero exit code
+        capture: Whether to return stdout in full instead of logging it
+        
+    Returns:
+        The completed process
+    """
+    return command_runner.run(command, check=check, capture=capture)
 
 
 def setup_temp_directory() -> str:
@@ -73,7 +367,8 @@ def setup_temp_directory() -> str:
     os.makedirs(temp_dir, exist_ok=True)
     
     # Add to tracking list
-    temp_directories.append(temp_dir)
+    with tracking_lock:
+        temp_directories.append(temp_dir)
     return temp_dir
 
 
@@ -108,89 +403,999 @@ def create_backup(requirements_file: str) -> str:
     backup_path = os.path.join(backup_dir, backup_name)
     
     shutil.copy2(requirements_file, backup_path)
-    print(color_text(f"Created backup: {backup_path}", Colors.BLUE))
+    log(color_text(f"Created backup: {backup_path}", Colors.BLUE))
     
     # Add to global tracking list
-    all_backup_files.append(backup_path)
+    with tracking_lock:
+        all_backup_files.append(backup_path)
     return backup_path
 
 
-def check_git_available() -> bool:
+def load_gitignore(directory: str) -> List[Tuple[str, bool, bool, bool]]:
     """
-    Checks if git is available on the system
+    Read the .gitignore file of a directory
     
+    Args:
+        directory: Path to the directory
+        
     Returns:
-        True if git is available, False otherwise
+        List of (pattern, negated, directory_only, anchored) rules in file order
     """
+    rules = []
     try:
-        subprocess.run(["git", "--version"], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        return True
-    except (subprocess.SubprocessError, FileNotFoundError):
-        return False
+        with open(os.path.join(directory, ".gitignore"), 'r', errors='replace') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return rules
+    
+    for line in lines:
+        line = line.rstrip()
+        if not line or line.startswith('#'):
+            continue
+        negated = line.startswith('!')
+        pattern = line[1:] if negated else line
+        directory_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        # A slash anywhere but at the end anchors the pattern to the .gitignore's directory
+        anchored = '/' in pattern
+        rules.append((pattern.lstrip('/'), negated, directory_only, anchored))
+    return rules
 
 
-def show_file_diff(original_file: str, updated_file: str) -> str:
+def is_ignored(relative_path: str, is_dir: bool, gitignores: List[Tuple[str, List[Tuple[str, bool, bool, bool]]]]) -> bool:
     """
-    Shows differences between two files using git diff or other tools
+    Check a path against the .gitignore rules of its parent directories
     
     Args:
-        original_file: Path to the original file
-        updated_file: Path to the updated file
+        relative_path: Path relative to the scan root, using "/" as separator
+        is_dir: Whether the path is a directory
+        gitignores: (directory relative to the scan root, rules) pairs, outermost first
         
     Returns:
-        String containing the diff output
+        True if the last matching rule ignores the path
     """
-    if not check_git_available():
-        return color_text("Git is not available on your system. Cannot display diff.", Colors.YELLOW)
+    ignored = False
+    for base, rules in gitignores:
+        path = relative_path[len(base) + 1:] if base else relative_path
+        name = path.rsplit('/', 1)[-1]
+        for pattern, negated, directory_only, anchored in rules:
+            if directory_only and not is_dir:
+                continue
+            if fnmatch.fnmatchcase(path if anchored else name, pattern.replace('**/', '*')):
+                ignored = not negated
+    return ignored
+
+
+def find_requirements_files(root: str = ".", excludes: Optional[List[str]] = None,
+                            use_gitignore: bool = True) -> Iterator[str]:
+    """
+    Lazily find requirements files below a directory
     
-    try:
-        # Use git diff with --no-index to compare files outside repository
-        result = subprocess.run(
-            ["git", "diff", "--no-index", "--color=always", original_file, updated_file], 
-            check=False, 
-            stdout=subprocess.PIPE, 
-            stderr=subprocess.PIPE,
-            text=True
-        )
+    Matches requirements.txt, requirements.in and variants such as requirements-dev.txt,
+    plus .txt/.in files inside a "requirements" directory. Excluded directories,
+    virtualenvs and paths ignored by .gitignore are pruned instead of being descended
+    into, and results are yielded as soon as they are found.
+    
+    Args:
+        root: Directory to scan
+        excludes: Directory names or relative paths (glob patterns) to skip
+        use_gitignore: Whether to honor .gitignore files
         
-        # git diff --no-index returns exit code 1 when files differ, which is normal
-        if result.returncode > 1:
-            return color_text(f"Error executing git diff: {result.stderr}", Colors.RED)
+    Yields:
+        Paths of requirements files, relative to the current directory if root is "."
+    """
+    excludes = DEFAULT_EXCLUDES if excludes is None else excludes
+    # Each stack entry: (directory path, path relative to root, .gitignore rules in effect)
+    stack = [(root, "", [])]
+    
+    while stack:
+        directory, relative_dir, gitignores = stack.pop()
+        if use_gitignore:
+            rules = load_gitignore(directory)
+            if rules:
+                gitignores = gitignores + [(relative_dir, rules)]
         
-        if not result.stdout.strip():
-            return color_text("No changes detected in the file.", Colors.YELLOW)
+        try:
+            with os.scandir(directory) as iterator:
+                entries = sorted(iterator, key=lambda entry: entry.name)
+        except OSError:
+            continue
         
-        return result.stdout
-    except Exception as e:
-        return color_text(f"Error executing diff: {str(e)}", Colors.RED)
+        subdirectories = []
+        for entry in entries:
+            relative_path = f"{relative_dir}/{entry.name}" if relative_dir else entry.name
+            path = entry.path if root != "." else relative_path.replace('/', os.sep)
+            
+            if entry.is_dir(follow_symlinks=False):
+                if any(fnmatch.fnmatchcase(entry.name, pattern) or fnmatch.fnmatchcase(relative_path, pattern)
+                       for pattern in excludes):
+                    continue
+                if os.path.exists(os.path.join(entry.path, "pyvenv.cfg")):
+                    continue  # virtualenv
+                if gitignores and is_ignored(relative_path, True, gitignores):
+                    continue
+                subdirectories.append((path, relative_path, gitignores))
+            elif entry.is_file():
+                in_requirements_dir = relative_dir.rsplit('/', 1)[-1] == "requirements" and entry.name.endswith((".txt", ".in"))
+                if not (REQUIREMENTS_FILE_PATTERN.match(entry.name) or in_requirements_dir):
+                    continue
+                if BACKUP_FILE_PATTERN.search(entry.name):
+                    continue
+                if gitignores and is_ignored(relative_path, False, gitignores):
+                    continue
+                yield path
+        
+        # Reversed so directories are visited in alphabetical order
+        stack.extend(reversed(subdirectories))
+
+
+def diff_requirements(original: "RequirementsFile", updated: "RequirementsFile") -> List[Dict[str, Optional[str]]]:
+    """
+    Compare the packages of two versions of a requirements file
+    
+    Args:
+        original: The parsed original file
+        updated: The parsed updated file
+        
+    Returns:
+        One entry per changed package with its name, the change ("added", "removed",
+        "upgraded", "downgraded" or "changed"), the old and new pin or specifier and,
+        for upgrades and downgrades, the release segment that changed ("major",
+        "minor", "patch" or "other")
+    """
+    def get_packages(parsed: "RequirementsFile") -> Dict[str, Tuple[str, str, Optional[str]]]:
+        packages = {}
+        for line in parsed.get_requirements():
+            spec = line.url or line.specifier
+            packages[normalize_package_name(line.name)] = (line.name, spec, line.pinned_version)
+        return packages
+    
+    old_packages = get_packages(original)
+    new_packages = get_packages(updated)
+    changes = []
+    
+    for key, (name, new_spec, new_version) in new_packages.items():
+        if key not in old_packages:
+            changes.append({"name": name, "change": "added", "old": None, "new": new_version or new_spec, "bump": None})
+            continue
+        
+        _, old_spec, old_version = old_packages[key]
+        if old_version and new_version:
+            old_key, new_key = get_version_key(old_version), get_version_key(new_version)
+            if old_key == new_key:
+                continue
+            change = "upgraded" if new_key > old_key else "downgraded"
+            changes.append({"name": name, "change": change, "old": old_version, "new": new_version,
+                            "bump": get_version_bump(old_version, new_version)})
+        elif old_spec != new_spec:
+            changes.append({"name": name, "change": "changed", "old": old_version or old_spec,
+                            "new": new_version or new_spec, "bump": None})
+    
+    for key, (name, old_spec, old_version) in old_packages.items():
+        if key not in new_packages:
+            changes.append({"name": name, "change": "removed", "old": old_version or old_spec, "new": None, "bump": None})
+    
+    return changes
+
+
+def get_version_bump(old_version: str, new_version: str) -> str:
+    """
+    Determine which release segment differs between two versions
+    
+    Args:
+        old_version: The old version
+        new_version: The new version
+        
+    Returns:
+        "major", "minor" or "patch" for the first differing release segment, "other" otherwise
+    """
+    old_release, new_release = get_version_key(old_version)[1:2], get_version_key(new_version)[1:2]
+    if not old_release or not new_release:
+        return "other"
+    old_parts, new_parts = list(old_release[0]), list(new_release[0])
+    length = max(len(old_parts), len(new_parts), 3)
+    old_parts += [0] * (length - len(old_parts))
+    new_parts += [0] * (length - len(new_parts))
+    for segment, old_part, new_part in zip(["major", "minor", "patch"], old_parts, new_parts):
+        if old_part != new_part:
+            return segment
+    return "other"
+
+
+def format_changes(changes: List[Dict[str, Optional[str]]]) -> str:
+    """
+    Format package changes as returned by diff_requirements for the terminal
+    
+    Args:
+        changes: The package changes
+        
+    Returns:
+        One colored line per change
+    """
+    if not changes:
+        return color_text("No changes detected in the file.", Colors.YELLOW)
+    
+    colors = {"added": Colors.GREEN, "removed": Colors.RED, "upgraded": Colors.GREEN,
+              "downgraded": Colors.YELLOW, "changed": Colors.CYAN}
+    lines = []
+    for change in changes:
+        if change["change"] == "added":
+            details = change["new"]
+        elif change["change"] == "removed":
+            details = change["old"]
+        else:
+            details = f"{change['old']} -> {change['new']}"
+            if change["bump"]:
+                details += f" ({change['bump']})"
+        lines.append(color_text(f"  {change['change']:<10} {change['name']} {details}".rstrip(), colors[change["change"]]))
+    return "\n".join(lines)
+
+
+class RequirementLine:
+    """
+    A logical line of a requirements file, possibly spanning several physical lines
+    
+    The original text is kept verbatim so that rendering an unmodified file reproduces it
+    byte for byte; set_version only replaces the version specifier (and hashes) in place.
+    
+    Attributes:
+        text: Original text of the line, including continuation backslashes and newlines
+        kind: One of "blank", "comment", "requirement", "url", "include", "constraint",
+              "editable" or "option"
+        content: The logical line with continuations joined and the comment removed
+        name: Package name (requirement lines only)
+        extras: Extras including brackets, e.g. "[security]"
+        specifier: Version specifier, e.g. ">=1.0,<2"
+        url: Direct reference URL of a "name @ url" requirement
+        marker: Environment marker
+        hashes: Values of --hash options, e.g. ["sha256:..."]
+        comment: Inline comment including the leading "#"
+        include_path: Resolved path of a -r/-c include
+        base_dir: Directory that relative include paths are resolved against
+    """
+    
+    def __init__(self, text: str, base_dir: str):
+        self.text = text
+        self.kind = "blank"
+        self.name: Optional[str] = None
+        self.extras = ""
+        self.specifier = ""
+        self.url: Optional[str] = None
+        self.marker: Optional[str] = None
+        self.hashes: List[str] = []
+        self.comment: Optional[str] = None
+        self.include_path: Optional[str] = None
+        self.specifier_span: Optional[Tuple[int, int]] = None
+        self.base_dir = base_dir
+        self.parse()
+    
+    def parse(self) -> None:
+        """Classify the line and split it into its components"""
+        physical_lines = self.text.splitlines()
+        # Continuation backslashes are dropped so offsets on the first physical line stay valid
+        logical = "".join(line[:-1] if line.endswith("\\") else line for line in physical_lines)
+        
+        comment_match = COMMENT_PATTERN.search(logical)
+        if comment_match:
+            self.comment = comment_match.group().strip()
+            logical = logical[:comment_match.start()]
+        self.content = logical.strip()
+        
+        if not self.content:
+            self.kind = "comment" if self.comment else "blank"
+            return
+        
+        option, _, value = self.content.partition(" ")
+        if "=" in option and option.startswith("--"):
+            option, _, value = self.content.partition("=")
+        if option in INCLUDE_OPTIONS:
+            self.kind = INCLUDE_OPTIONS[option]
+            self.include_path = os.path.normpath(os.path.join(self.base_dir, value.strip()))
+            return
+        if option in ("-e", "--editable"):
+            self.kind = "editable"
+            return
+        if self.content.startswith("-"):
+            self.kind = "option"
+            return
+        
+        # Per-requirement options such as --hash start at the first token beginning with a dash
+        options_start = re.search(r"\s-", logical)
+        requirement_end = options_start.start() if options_start else len(logical)
+        self.hashes = HASH_PATTERN.findall(logical[requirement_end:])
+        
+        match = REQUIREMENT_PATTERN.match(logical[:requirement_end])
+        if not match or not SPECIFIER_PATTERN.match(match.group("specifier") or ""):
+            self.kind = "url"  # plain URL, archive or local path
+            return
+        
+        self.kind = "requirement"
+        self.name = match.group("name")
+        self.extras = match.group("extras") or ""
+        self.url = match.group("url")
+        self.marker = match.group("marker")
+        
+        if self.url is None:
+            self.specifier = match.group("specifier").strip()
+            first_line_length = len(physical_lines[0].rstrip("\\"))
+            if self.specifier:
+                start, end = match.span("specifier")
+            else:
+                start = end = match.end("extras") if self.extras else match.end("name")
+            if end <= first_line_length:
+                self.specifier_span = (start, end)
+    
+    @property
+    def requirement(self) -> str:
+        """Requirement without version specifier, as passed to pip to get the latest version"""
+        marker = f"; {self.marker}" if self.marker else ""
+        return f"{self.name}{self.extras}{marker}"
+    
+    @property
+    def pinned_version(self) -> Optional[str]:
+        """Version of an exact "==" pin, or None if the requirement is not pinned"""
+        match = re.fullmatch(r"\(?\s*===?\s*([^,\s)]+)\s*\)?", self.specifier)
+        return match.group(1) if match else None
+    
+    def set_version(self, version: str, hashes: Optional[List[str]] = None) -> bool:
+        """
+        Pin the requirement to a version, leaving the rest of the line untouched
+        
+        Args:
+            version: The version to pin
+            hashes: New hashes for hash-pinned requirements, e.g. ["sha256:..."]
+            
+        Returns:
+            True if the line was rewritten, False if it cannot be rewritten safely
+        """
+        if self.kind != "requirement" or self.specifier_span is None:
+            return False
+        if self.pinned_version == version:
+            return True
+        if self.hashes and not hashes:
+            return False  # the existing hashes would no longer match
+        
+        start, end = self.specifier_span
+        text = f"{self.text[:start]}=={version}{self.text[end:]}"
+        if self.hashes:
+            text = replace_hashes(text, hashes)
+        
+        self.text = text
+        self.parse()
+        return True
+
+
+class RequirementsFile:
+    """
+    Parsed representation of a requirements file and the files it includes
+    
+    Attributes:
+        path: Path to the file
+        lines: Logical lines of the file in order
+        includes: Parsed files referenced with -r or -c
+    """
+    
+    def __init__(self, path: str, lines: List[RequirementLine], includes: List["RequirementsFile"]):
+        self.path = path
+        self.lines = lines
+        self.includes = includes
+    
+    def iter_lines(self, recursive: bool = False) -> Iterator[RequirementLine]:
+        """
+        Iterate over the logical lines of this file, optionally followed by those of its includes
+        
+        Args:
+            recursive: Whether to descend into -r/-c includes
+        """
+        yield from self.lines
+        if recursive:
+            for include in self.includes:
+                yield from include.iter_lines(recursive=True)
+    
+    def get_requirements(self) -> List[RequirementLine]:
+        """Get the named requirements declared directly in this file"""
+        return [line for line in self.lines if line.kind == "requirement"]
+    
+    def render(self) -> str:
+        """Render the file, reproducing untouched lines exactly"""
+        return "".join(line.text for line in self.lines)
+    
+    def write(self, path: Optional[str] = None) -> None:
+        """
+        Write the rendered file
+        
+        Args:
+            path: Destination path, defaults to the path the file was parsed from
+        """
+        with open(path or self.path, "w", newline="") as f:
+            f.write(self.render())
+
+
+def replace_hashes(text: str, hashes: List[str]) -> str:
+    """
+    Replace the --hash options of a requirement line, keeping their layout
+    
+    Hashes written one per continuation line (as pip-compile does) are replaced by
+    the same number of lines with the same indentation; inline hashes stay inline.
+    
+    Args:
+        text: Text of the requirement line
+        hashes: The new hashes, e.g. ["sha256:..."]
+        
+    Returns:
+        The line with its hashes replaced
+    """
+    physical_lines = text.splitlines(keepends=True)
+    hash_lines = [i for i, line in enumerate(physical_lines) if line.lstrip().startswith("--hash")]
+    
+    if hash_lines and all(HASH_PATTERN.findall(line) for line in (physical_lines[i] for i in hash_lines)):
+        first, last = hash_lines[0], hash_lines[-1]
+        template = physical_lines[first]
+        indent = template[:len(template) - len(template.lstrip())]
+        newline = template[len(template.rstrip("\r\n")):] or "\n"
+        last_ending = physical_lines[last][len(physical_lines[last].rstrip("\r\n")):]
+        last_continues = physical_lines[last].rstrip("\r\n").endswith("\\")
+        
+        new_lines = [f"{indent}--hash={value} \\{newline}" for value in hashes]
+        new_lines[-1] = f"{indent}--hash={hashes[-1]}" + (f" \\{newline}" if last_continues else last_ending)
+        return "".join(physical_lines[:first] + new_lines + physical_lines[last + 1:])
+    
+    pattern = re.compile(r"\s*" + HASH_PATTERN.pattern)
+    first = pattern.search(text)
+    remaining = pattern.sub("", text)
+    inline = " ".join(f"--hash={value}" for value in hashes)
+    return f"{remaining[:first.start()]} {inline}{remaining[first.start():]}"
 
 
-def parse_requirements(file_path: str) -> List[str]:
+def parse_requirements_file(file_path: str, _parents: Optional[Set[str]] = None) -> RequirementsFile:
     """
-    Parse a requirements file and return a list of package specifications
+    Parse a requirements file and, recursively, the files it includes
+    
+    Parsed files are cached by path and invalidated when their modification time or
+    size changes, so files included from many places are only parsed once per run.
     
     Args:
         file_path: Path to the requirements file
         
     Returns:
-        List of package specifications
+        The parsed file
+    """
+    path = os.path.abspath(file_path)
+    parents = (_parents or set()) | {path}
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    
+    with parsed_files_lock:
+        cached = parsed_files_cache.get(path)
+        if cached and cached[0] == signature:
+            return cached[1]
+        
+        with open(path, "r", newline="") as f:
+            physical_lines = f.read().splitlines(keepends=True)
+        
+        # Group physical lines into logical lines joined by trailing backslashes
+        base_dir = os.path.dirname(path)
+        lines = []
+        buffer = ""
+        for physical_line in physical_lines:
+            buffer += physical_line
+            if not physical_line.rstrip("\r\n").endswith("\\"):
+                lines.append(RequirementLine(buffer, base_dir))
+                buffer = ""
+        if buffer:
+            lines.append(RequirementLine(buffer, base_dir))
+        
+        includes = [
+            parse_requirements_file(line.include_path, parents)
+            for line in lines
+            if line.include_path and line.include_path not in parents and os.path.exists(line.include_path)
+        ]
+        
+        parsed = RequirementsFile(path, lines, includes)
+        parsed_files_cache[path] = (signature, parsed)
+        return parsed
+
+
+def get_venv_python(venv_path: str) -> str:
+    """
+    Get the path of the Python interpreter inside a virtualenv
+    
+    Args:
+        venv_path: Path to the virtualenv
+        
+    Returns:
+        Path to the venv's python executable
+    """
+    if os.name == 'nt':  # Windows
+        return os.path.join(venv_path, "Scripts", "python")
+    return os.path.join(venv_path, "bin", "python")
+
+
+def create_venv(venv_path: str, requirements_file: str) -> None:
+    """
+    Create a virtualenv, update its pip and install the given requirements file into it
+    
+    Args:
+        venv_path: Path where the virtualenv should be created
+        requirements_file: Path to the requirements file to install
+    """
+    log(color_text(f"Creating virtualenv in: {venv_path}", Colors.BLUE))
+    with timing_report.span("venv_create"):
+        run_command([sys.executable, "-m", "venv", venv_path], check=True)
+    python_path = get_venv_python(venv_path)
+    
+    log(color_text("Updating pip...", Colors.BLUE))
+    with timing_report.span("pip_upgrade"):
+        run_command([python_path, "-m", "pip", "install", "--upgrade", "pip"], check=True)
+    
+    log(color_text(f"Installing packages from {requirements_file}...", Colors.BLUE))
+    with timing_report.span("install"):
+        run_command([python_path, "-m", "pip", "install", "-r", requirements_file], check=True)
+
+
+def get_cache_key(parsed: RequirementsFile) -> str:
+    """
+    Compute the cache key of a requirement set
+    
+    The key covers the interpreter version and platform and the requirement lines of
+    the file and everything it includes with -r/-c, with whitespace and case
+    normalized and order ignored, so editing an included file invalidates the entry.
+    Lines that may reference local paths (editables, URLs and paths, options such as
+    --find-links) also cover the directory they are relative to, so "-e ." in two
+    projects never shares a venv.
+    
+    Args:
+        parsed: The parsed requirements file
+        
+    Returns:
+        Hex digest identifying the requirement set
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{platform.python_implementation()} {platform.python_version()} {sys.platform}\n".encode())
+    
+    contents = set()
+    for line in parsed.iter_lines(recursive=True):
+        if not line.content:
+            continue
+        content = " ".join(line.content.split()).lower()
+        if line.kind in ("editable", "url", "option") or line.url:
+            content += f" (in {os.path.abspath(line.base_dir)})"
+        contents.add(content)
+    for content in sorted(contents):
+        digest.update(f"{content}\n".encode())
+    
+    return digest.hexdigest()[:32]
+
+
+def get_directory_size(path: str) -> int:
+    """
+    Compute the total size of all files below a directory, without following symlinks
+    
+    Args:
+        path: Path to the directory
+        
+    Returns:
+        Size in bytes
+    """
+    total = 0
+    for dir_path, _, file_names in os.walk(path):
+        for file_name in file_names:
+            try:
+                total += os.lstat(os.path.join(dir_path, file_name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def evict_venv_cache(cache_dir: str, max_size: int, keep: Optional[str] = None) -> None:
+    """
+    Remove the least recently used cache entries until the cache fits in max_size
+    
+    Args:
+        cache_dir: Path to the virtualenv cache
+        max_size: Maximum total size of the cache in MB
+        keep: Path of an entry that must not be evicted
+    """
+    with cache_lock:
+        entries = []
+        for name in os.listdir(cache_dir):
+            entry_path = os.path.join(cache_dir, name)
+            stamp_path = os.path.join(entry_path, "last_used")
+            if not os.path.exists(stamp_path):
+                continue  # entry still being built
+            entries.append((os.path.getmtime(stamp_path), entry_path, get_directory_size(entry_path)))
+        
+        total_size = sum(size for _, _, size in entries)
+        for _, entry_path, size in sorted(entries):
+            if total_size <= max_size * 1024 * 1024:
+                break
+            if entry_path == keep:
+                continue
+            log(color_text(f"Evicting cached virtualenv: {entry_path}", Colors.BLUE))
+            shutil.rmtree(entry_path, ignore_errors=True)
+            total_size -= size
+
+
+def prepare_cached_venv(parsed: RequirementsFile, venv_path: str, cache_dir: str, max_size: int) -> None:
+    """
+    Provide a virtualenv with the requirements installed, reusing a cached one if possible
+    
+    Cache entries are never modified after they are built: the entry is copied to
+    venv_path, so packages can be upgraded there without invalidating the cache.
+    
+    Args:
+        parsed: The parsed requirements file
+        venv_path: Path where the working virtualenv should be placed
+        cache_dir: Path to the virtualenv cache
+        max_size: Maximum total size of the cache in MB
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    key = get_cache_key(parsed)
+    entry_path = os.path.join(cache_dir, key)
+    
+    with cache_lock:
+        key_lock = cache_locks.setdefault(key, threading.Lock())
+    
+    with key_lock:
+        if os.path.exists(os.path.join(entry_path, "last_used")):
+            log(color_text(f"Reusing cached virtualenv: {entry_path}", Colors.BLUE))
+        else:
+            # Build under a private name and rename, so other processes never see a partial entry
+            build_path = f"{entry_path}.partial_{uuid.uuid4().hex[:8]}"
+            try:
+                create_venv(os.path.join(build_path, "venv"), parsed.path)
+                open(os.path.join(build_path, "last_used"), 'w').close()
+                os.rename(build_path, entry_path)
+            except OSError:
+                if not os.path.exists(os.path.join(entry_path, "last_used")):
+                    raise
+            finally:
+                shutil.rmtree(build_path, ignore_errors=True)
+        
+        # Mark the entry as recently used for LRU eviction
+        os.utime(os.path.join(entry_path, "last_used"))
+        log(color_text(f"Copying cached virtualenv to: {venv_path}", Colors.BLUE))
+        with timing_report.span("venv_copy", cache_key=key):
+            shutil.copytree(os.path.join(entry_path, "venv"), venv_path, symlinks=True)
+    
+    evict_venv_cache(cache_dir, max_size, keep=entry_path)
+
+
+def normalize_package_name(name: str) -> str:
+    """
+    Normalize a package name as defined by PEP 503
+    
+    Args:
+        name: The package name
+        
+    Returns:
+        Lowercase name with runs of -, _ and . replaced by a single dash
     """
-    requirements = []
-    with open(file_path, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if line and not line.startswith('#'):
-                requirements.append(line)
-    return requirements
+    return re.sub(r"[-_.]+", "-", name).lower()
 
 
-def update_requirements(requirements_file: str, use_freeze: bool = False) -> Dict[str, str]:
+def get_installed_versions(pip_command: List[str]) -> Dict[str, str]:
+    """
+    Read the versions of all packages installed in a venv with one pip call
+    
+    Args:
+        pip_command: Command running pip inside the venv
+        
+    Returns:
+        Dictionary mapping normalized package names to installed versions
+    """
+    result = run_command(pip_command + ["list", "--format=json", "--disable-pip-version-check"], check=True, capture=True)
+    return {normalize_package_name(package["name"]): package["version"] for package in json.loads(result.stdout)}
+
+
+def upgrade_packages_batch(pip_command: List[str], requirements: List[str]) -> None:
+    """
+    Upgrade packages to their latest versions in a single resolver run
+    
+    Resolving all packages together lets pip pick versions that are compatible with
+    each other, instead of a later upgrade silently downgrading an earlier one.
+    
+    Args:
+        pip_command: Command running pip inside the venv
+        requirements: Requirements to upgrade, without version specifiers
+    """
+    log(color_text(f"Updating {len(requirements)} packages in a single pass...", Colors.BLUE))
+    with timing_report.span("package_upgrade", packages=len(requirements)):
+        run_command(pip_command + ["install", "--upgrade"] + requirements, check=True)
+
+
+def upgrade_packages_individually(pip_command: List[str], requirements: List[str]) -> Set[str]:
+    """
+    Upgrade packages to their latest versions one pip invocation at a time
+    
+    Args:
+        pip_command: Command running pip inside the venv
+        requirements: Requirements to upgrade, without version specifiers
+        
+    Returns:
+        The requirements that failed to upgrade
+    """
+    failed_requirements = set()
+    for requirement in requirements:
+        log(color_text(f"Updating {requirement}...", Colors.BLUE))
+        try:
+            with timing_report.span("package_upgrade", package=requirement):
+                run_command(pip_command + ["install", "--upgrade", requirement], check=True)
+        except subprocess.SubprocessError:
+            log(color_text(f"Failed to update {requirement}, keeping original specification", Colors.YELLOW))
+            failed_requirements.add(requirement)
+    return failed_requirements
+
+
+def pin_requirement(line: RequirementLine, version: str, hashes: Optional[List[str]] = None) -> None:
+    """
+    Pin a requirement line to a new version, warning if it has to be kept as it is
+    
+    Args:
+        line: The requirement line
+        version: The version to pin
+        hashes: Hashes of the new version's files, needed for hash-pinned requirements
+    """
+    if not line.set_version(version, hashes):
+        reason = "hashes of the new version are unknown" if line.hashes else "it cannot be rewritten in place"
+        log(color_text(f"Keeping original specification of {line.name}: {reason}", Colors.YELLOW))
+
+
+def update_in_venv(parsed: RequirementsFile, pip_command: List[str], batch: bool = True) -> None:
+    """
+    Upgrade the direct dependencies of a file inside a venv and pin the installed versions
+    
+    Args:
+        parsed: The parsed requirements file, updated in place
+        pip_command: Command running pip inside the venv
+        batch: Whether to upgrade all direct dependencies in a single pip invocation
+    """
+    requirements = [line for line in parsed.get_requirements() if line.url is None]
+    upgradable = list(dict.fromkeys(line.requirement for line in requirements))
+    failed_requirements: Set[str] = set()
+    
+    if batch and upgradable:
+        try:
+            upgrade_packages_batch(pip_command, upgradable)
+        except subprocess.SubprocessError:
+            log(color_text("Batch upgrade failed, upgrading packages one by one...", Colors.YELLOW))
+            batch = False
+    
+    if not batch:
+        failed_requirements = upgrade_packages_individually(pip_command, upgradable)
+    
+    # Read back all installed versions in a single call
+    with timing_report.span("inventory"):
+        installed_versions = get_installed_versions(pip_command)
+    
+    for line in requirements:
+        version = installed_versions.get(normalize_package_name(line.name))
+        if version and line.requirement not in failed_requirements:
+            pin_requirement(line, version)
+
+
+def get_version_key(version: str) -> Tuple:
+    """
+    Build a sort key ordering versions as defined by PEP 440
+    
+    Args:
+        version: The version string
+        
+    Returns:
+        Tuple comparable with keys of other versions; invalid versions sort first
+    """
+    match = VERSION_PATTERN.match(version)
+    if not match:
+        return (-1,)
+    
+    epoch, release, pre_label, pre_number, post_implicit, post_number, dev_number = match.groups()
+    release_parts = [int(part) for part in release.split(".")]
+    while len(release_parts) > 1 and release_parts[-1] == 0:
+        release_parts.pop()
+    
+    is_post = post_implicit is not None or post_number is not None
+    is_dev = dev_number is not None
+    if pre_label:
+        pre_rank = {"a": 0, "alpha": 0, "b": 1, "beta": 1}.get(pre_label.lower(), 2)
+        pre = (pre_rank, int(pre_number or 0))
+    elif is_dev and not is_post:
+        pre = (-1, 0)  # 1.0.dev1 sorts before 1.0a1
+    else:
+        pre = (3, 0)
+    post = int(post_implicit or post_number or 0) if is_post else -1
+    dev = int(dev_number or 0) if is_dev else float("inf")
+    
+    return (int(epoch or 0), tuple(release_parts), pre, post, dev)
+
+
+def is_prerelease(version: str) -> bool:
+    """
+    Check whether a version is a pre-release or development release
+    
+    Args:
+        version: The version string
+        
+    Returns:
+        True for pre-releases, development releases and unparsable versions
+    """
+    match = VERSION_PATTERN.match(version)
+    return not match or match.group(3) is not None or match.group(7) is not None
+
+
+def version_matches(version: str, specifier: str) -> bool:
+    """
+    Check whether a version satisfies a comma separated specifier such as ">=3.8,!=3.9.*"
+    
+    Args:
+        version: The version string
+        specifier: The version specifier
+        
+    Returns:
+        True if every clause of the specifier is satisfied
+    """
+    version_key = get_version_key(version)
+    release = version.split("+")[0].split(".")
+    
+    for clause in filter(None, (part.strip() for part in specifier.split(","))):
+        match = re.match(r"^(~=|===|==|!=|<=|>=|<|>)\s*(.+)$", clause)
+        if not match:
+            continue
+        operator, target = match.groups()
+        
+        if target.endswith(".*") and operator in ("==", "!="):
+            prefix = target[:-2].split(".")
+            padded = release + ["0"] * (len(prefix) - len(release))
+            matched = [int(part) for part in padded[:len(prefix)] if part.isdigit()] == [int(part) for part in prefix]
+            if matched != (operator == "=="):
+                return False
+            continue
+        
+        target_key = get_version_key(target)
+        if operator == "~=":
+            prefix = target.split(".")[:-1]
+            if version_key < target_key or not version_matches(version, f"=={'.'.join(prefix)}.*"):
+                return False
+        elif operator == "===" and version != target:
+            return False
+        elif ((operator == "==" and version_key != target_key)
+              or (operator == "!=" and version_key == target_key)
+              or (operator == "<=" and version_key > target_key)
+              or (operator == ">=" and version_key < target_key)
+              or (operator == "<" and version_key >= target_key)
+              or (operator == ">" and version_key <= target_key)):
+            return False
+    
+    return True
+
+
+def fetch_package_metadata(package_name: str, index_url: str) -> Dict[str, Any]:
+    """
+    Download the JSON metadata of a package from a PyPI-compatible JSON API
+    
+    Args:
+        package_name: Name of the package
+        index_url: Base URL of the JSON API, or a local directory laid out as <name>/json
+        
+    Returns:
+        The decoded metadata document
+    """
+    if not urllib.parse.urlparse(index_url).scheme or os.path.isdir(index_url):
+        index_url = urllib.parse.urljoin("file:", urllib.request.pathname2url(os.path.abspath(index_url)))
+    url = f"{index_url.rstrip('/')}/{normalize_package_name(package_name)}/json"
+    
+    with urllib.request.urlopen(url, timeout=30) as response:
+        return json.load(response)
+
+
+def get_latest_release(metadata: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Pick the newest stable release that supports the running Python version
+    
+    Args:
+        metadata: Package metadata as returned by fetch_package_metadata
+        
+    Returns:
+        Dictionary with the release version and the sha256 hashes of its files,
+        or None if no compatible release exists
+    """
+    python_version = platform.python_version()
+    releases = metadata.get("releases") or {}
+    candidates = []
+    
+    for version, files in releases.items():
+        files = [file for file in files if not file.get("yanked")]
+        if not files or is_prerelease(version):
+            continue
+        requires_python = files[0].get("requires_python") or ""
+        if version_matches(python_version, requires_python):
+            candidates.append(version)
+    
+    if candidates:
+        version = max(candidates, key=get_version_key)
+        files = metadata["releases"][version]
+    elif not releases and metadata.get("info", {}).get("version"):
+        # Mirrors that only publish the info section still report the latest version; when
+        # releases are listed but none is stable and compatible, there is nothing to pin
+        version = metadata["info"]["version"]
+        files = metadata.get("urls") or []
+    else:
+        return None
+    
+    hashes = [file["digests"]["sha256"] for file in files if file.get("digests", {}).get("sha256") and not file.get("yanked")]
+    return {"version": version, "hashes": hashes}
+
+
+def resolve_latest_versions(package_names: List[str], index_url: str) -> Dict[str, Optional[Dict[str, Any]]]:
+    """
+    Look up the latest compatible release of several packages concurrently
+    
+    Args:
+        package_names: Names of the packages
+        index_url: Base URL of the JSON API, or a local directory laid out as <name>/json
+        
+    Returns:
+        Dictionary mapping each package name to its latest release, or None if the lookup failed
+    """
+    # Results are remembered for the rest of the run, files often share dependencies.
+    # Errors are returned rather than logged, so they end up in the output buffer of the
+    # calling thread instead of being printed from the lookup threads.
+    def lookup(package_name: str) -> Tuple[Optional[Dict[str, Any]], Optional[Exception]]:
+        cache_key = (index_url, normalize_package_name(package_name))
+        if cache_key in latest_release_cache:
+            return latest_release_cache[cache_key], None
+        try:
+            release = get_latest_release(fetch_package_metadata(package_name, index_url))
+        except (OSError, ValueError) as e:
+            return None, e
+        if release:
+            latest_release_cache[cache_key] = release
+        return release, None
+    
+    releases = {}
+    with ThreadPoolExecutor(max_workers=INDEX_WORKERS) as executor:
+        for package_name, (release, error) in zip(package_names, executor.map(lookup, package_names)):
+            if error:
+                log(color_text(f"Failed to look up {package_name}: {error}", Colors.YELLOW))
+            releases[package_name] = release
+    return releases
+
+
+def update_from_index(parsed: RequirementsFile, index_url: str) -> None:
+    """
+    Pin the direct dependencies of a file to the latest versions published in the index
+    
+    Args:
+        parsed: The parsed requirements file, updated in place
+        index_url: Base URL of the JSON API, or a local directory laid out as <name>/json
+    """
+    requirements = [line for line in parsed.get_requirements() if line.url is None]
+    with timing_report.span("index_lookup", packages=len(requirements)):
+        releases = resolve_latest_versions(list(dict.fromkeys(line.name for line in requirements)), index_url)
+    
+    for line in requirements:
+        release = releases.get(line.name)
+        if release:
+            pin_requirement(line, release["version"], [f"sha256:{value}" for value in release["hashes"]])
+
+
+def update_requirements(requirements_file: str, use_freeze: bool = False,
+                        batch: bool = True,
+                        resolve_only: bool = False,
+                        index_url: str = DEFAULT_INDEX_URL,
+                        cache_dir: Optional[str] = None,
+                        cache_max_size: int = DEFAULT_CACHE_MAX_SIZE) -> Dict[str, str]:
     """
     Updates requirements.txt file by creating venv, installing and updating packages
     
     Args:
         requirements_file: Path to the requirements file
         use_freeze: Whether to use pip freeze (include all subdependencies)
+        batch: Whether to upgrade all direct dependencies in a single pip invocation
+        resolve_only: Whether to look up the latest versions in the index without building a venv
+        index_url: Base URL of the JSON API used in resolve-only mode
+        cache_dir: Path to the shared virtualenv cache, or None to always build a fresh venv
+            (the cache is never used with use_freeze)
+        cache_max_size: Maximum total size of the virtualenv cache in MB
         
     Returns:
         Dictionary containing paths to the updated and backup files
@@ -199,98 +1404,60 @@ def update_requirements(requirements_file: str, use_freeze: bool = False) -> Dic
     if not file_dir:
         file_dir = "."
     
-    print(color_text(f"\nUpdating file: {requirements_file}", Colors.CYAN))
+    log(color_text(f"\nUpdating file: {requirements_file}", Colors.CYAN))
     
     # Parse original requirements to maintain the same format
-    original_requirements = parse_requirements(requirements_file)
+    parsed = parse_requirements_file(requirements_file)
     
     # Create backup
     backup_file = create_backup(requirements_file)
     
-    # Create local temporary directory
-    temp_dir = setup_temp_directory()
-    venv_path = os.path.join(temp_dir, "venv")
-    
     try:
-        # Create venv
-        print(color_text(f"Creating virtualenv in: {venv_path}", Colors.BLUE))
-        subprocess.run([sys.executable, "-m", "venv", venv_path], check=True)
-        
-        # Path to pip in venv
-        if os.name == 'nt':  # Windows
-            pip_path = os.path.join(venv_path, "Scripts", "pip")
-            python_path = os.path.join(venv_path, "Scripts", "python")
-        else:  # Linux/MacOS
-            pip_path = os.path.join(venv_path, "bin", "pip")
-            python_path = os.path.join(venv_path, "bin", "python")
-        
-        # Update pip
-        print(color_text("Updating pip...", Colors.BLUE))
-        subprocess.run([pip_path, "install", "--upgrade", "pip"], check=True)
-        
-        # Install packages from requirements.txt
-        print(color_text(f"Installing packages from {requirements_file}...", Colors.BLUE))
-        subprocess.run([pip_path, "install", "-r", requirements_file], check=True)
-        
-        if use_freeze:
-            # Use pip freeze to get all dependencies
-            print(color_text("Generating requirements using pip freeze (including all subdependencies)...", Colors.BLUE))
-            temp_requirements = os.path.join(temp_dir, "requirements_updated.txt")
+        if resolve_only:
+            # Take the new pins straight from the index metadata, nothing is installed
+            log(color_text(f"Resolving latest versions from {index_url} (no virtualenv)...", Colors.BLUE))
+            update_from_index(parsed, index_url)
+            parsed.write()
+        else:
+            # Create local temporary directory
+            temp_dir = setup_temp_directory()
+            venv_path = os.path.join(temp_dir, "venv")
             
-            with open(temp_requirements, "w") as f:
-                subprocess.run([pip_path, "freeze"], stdout=f, check=True)
+            # pip freeze reports whatever the venv holds, so a cached venv would keep reporting the
+            # versions of the day it was built; direct mode upgrades the copy and can reuse it
+            if cache_dir and not use_freeze:
+                prepare_cached_venv(parsed, venv_path, cache_dir, cache_max_size)
+            else:
+                create_venv(venv_path, requirements_file)
             
-            # Copy updated requirements.txt
-            shutil.copy2(temp_requirements, requirements_file)
-        else:
-            # Update each package to the latest version (direct dependencies only)
-            print(color_text("Updating packages to latest versions (direct dependencies only)...", Colors.BLUE))
-            updated_packages = []
+            # Run pip through the venv's interpreter; console script shebangs break when a venv is copied
+            pip_command = [get_venv_python(venv_path), "-m", "pip"]
             
-            for req in original_requirements:
-                # Extract package name (remove version specifiers)
-                package_name = req.split('==')[0].split('>=')[0].split('<=')[0].split('>')[0].split('<')[0].split('~=')[0].strip()
+            if use_freeze:
+                # Use pip freeze to get all dependencies
+                log(color_text("Generating requirements using pip freeze (including all subdependencies)...", Colors.BLUE))
+                with timing_report.span("freeze"):
+                    result = run_command(pip_command + ["freeze"], check=True, capture=True)
                 
-                # Update the package
-                print(color_text(f"Updating {package_name}...", Colors.BLUE))
-                try:
-                    subprocess.run([pip_path, "install", "--upgrade", package_name], check=True)
-                    
-                    # Get the installed version
-                    result = subprocess.run(
-                        [pip_path, "show", package_name], 
-                        check=True, 
-                        stdout=subprocess.PIPE, 
-                        text=True
-                    )
-                    
-                    # Extract version
-                    version = None
-                    for line in result.stdout.splitlines():
-                        if line.startswith("Version:"):
-                            version = line.split(":", 1)[1].strip()
-                            break
-                    
-                    if version:
-                        updated_packages.append(f"{package_name}=={version}")
-                    else:
-                        updated_packages.append(req)
-                except subprocess.SubprocessError:
-                    print(color_text(f"Failed to update {package_name}, keeping original specification", Colors.YELLOW))
-                    updated_packages.append(req)
-            
-            # Write updated requirements
-            with open(requirements_file, "w") as f:
-                for package in updated_packages:
-                    f.write(f"{package}\n")
+                # Write updated requirements.txt
+                with open(requirements_file, "w") as f:
+                    f.write(result.stdout)
+            else:
+                # Update each package to the latest version (direct dependencies only)
+                log(color_text("Updating packages to latest versions (direct dependencies only)...", Colors.BLUE))
+                update_in_venv(parsed, pip_command, batch=batch)
+                parsed.write()
         
-        print(color_text(f"Updated file: {requirements_file}", Colors.GREEN))
+        log(color_text(f"Updated file: {requirements_file}", Colors.GREEN))
         
         # Return both original backup and updated file
         return {"updated_file": requirements_file, "backup_file": backup_file}
     
     except Exception as e:
-        print(color_text(f"Error during update: {str(e)}", Colors.RED))
+        log(color_text(f"Error during update: {str(e)}", Colors.RED))
+        # Forget the partially rewritten parse so the file is read again next time
+        with parsed_files_lock:
+            parsed_files_cache.pop(parsed.path, None)
         raise
     
     finally:
@@ -298,6 +1465,262 @@ def update_requirements(requirements_file: str, use_freeze: bool = False) -> Dic
         pass
 
 
+class UpdateState:
+    """
+    Persistent record of the last successful update of each requirements file
+    
+    For every file the state stores a hash of its content (including included files),
+    the pinned versions and the latest versions the index reported at the time. A file
+    only needs to be processed again if its content or one of those index versions changed.
+    
+    Attributes:
+        path: Path to the JSON state file
+        files: State entries keyed by absolute path of the requirements file
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    self.files = json.load(f).get("files", {})
+            except (OSError, ValueError) as e:
+                print(color_text(f"Warning: Ignoring unreadable state file {path}: {e}", Colors.YELLOW))
+    
+    def save(self) -> None:
+        """Write the state file atomically"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temp_path = f"{self.path}.{uuid.uuid4().hex[:8]}.tmp"
+        with self.lock:
+            with open(temp_path, 'w') as f:
+                json.dump({"version": 1, "files": self.files}, f, indent=2, sort_keys=True)
+        os.replace(temp_path, self.path)
+    
+    @staticmethod
+    def get_content_hash(parsed: RequirementsFile) -> str:
+        """
+        Hash the content of a requirements file and every file it includes
+        
+        Args:
+            parsed: The parsed requirements file
+            
+        Returns:
+            Hex digest of the rendered files
+        """
+        digest = hashlib.sha256(parsed.render().encode())
+        for include in parsed.includes:
+            digest.update(UpdateState.get_content_hash(include).encode())
+        return digest.hexdigest()
+    
+    @staticmethod
+    def get_index_snapshot(parsed: RequirementsFile, index_url: str) -> Optional[Dict[str, str]]:
+        """
+        Look up the latest versions of all packages named in a file
+        
+        Args:
+            parsed: The parsed requirements file
+            index_url: Base URL of the JSON API
+            
+        Returns:
+            Dictionary mapping normalized package names to latest versions, or None if a lookup failed
+        """
+        names = sorted({normalize_package_name(line.name) for line in parsed.get_requirements()})
+        releases = resolve_latest_versions(names, index_url)
+        if any(release is None for release in releases.values()):
+            return None
+        return {name: release["version"] for name, release in releases.items()}
+    
+    def is_up_to_date(self, requirements_file: str, mode: str, index_url: str) -> bool:
+        """
+        Check whether a file is unchanged since its last update and no newer versions exist
+        
+        Args:
+            requirements_file: Path to the requirements file
+            mode: Update mode the file would be processed with
+            index_url: Base URL of the JSON API used for the index snapshot
+            
+        Returns:
+            True if processing the file again cannot change it
+        """
+        with self.lock:
+            entry = self.files.get(os.path.abspath(requirements_file))
+        if not entry or entry.get("mode") != mode or entry.get("index_url") != index_url:
+            return False
+        
+        parsed = parse_requirements_file(requirements_file)
+        if self.get_content_hash(parsed) != entry.get("content_hash"):
+            return False
+        # A failed lookup proves nothing about the index, so such a file is always checked again
+        snapshot = self.get_index_snapshot(parsed, index_url)
+        return snapshot is not None and snapshot == entry.get("index_snapshot")
+    
+    def record(self, requirements_file: str, mode: str, index_url: str) -> None:
+        """
+        Record the state of a freshly updated file
+        
+        Args:
+            requirements_file: Path to the requirements file
+            mode: Update mode the file was processed with
+            index_url: Base URL of the JSON API used for the index snapshot
+        """
+        parsed = parse_requirements_file(requirements_file)
+        entry = {
+            "mode": mode,
+            "index_url": index_url,
+            "content_hash": self.get_content_hash(parsed),
+            "versions": {line.name: line.pinned_version for line in parsed.get_requirements()},
+            "index_snapshot": self.get_index_snapshot(parsed, index_url),
+            "updated_at": datetime.now().isoformat(timespec="seconds")
+        }
+        with self.lock:
+            self.files[os.path.abspath(requirements_file)] = entry
+        self.save()
+
+
+def process_file(requirements_file: str, buffered: bool = False, state: Optional[UpdateState] = None,
+                 **update_options: Any) -> Dict[str, Any]:
+    """
+    Update a single requirements file and record the outcome for the run summary
+    
+    Args:
+        requirements_file: Path to the requirements file
+        buffered: Whether to collect output in a per-file buffer instead of printing it
+        state: Incremental mode state; files that are up to date according to it are skipped
+        **update_options: Keyword arguments passed on to update_requirements
+        
+    Returns:
+        Dictionary with the file, status, duration, update result, package changes, error and buffered log
+    """
+    if buffered:
+        thread_output.buffer = []
+    thread_output.file = requirements_file
+    thread_output.tail = deque(maxlen=command_runner.tail_lines)
+    start_time = time.monotonic()
+    outcome: Dict[str, Any] = {
+        "file": requirements_file, "status": "updated", "result": None, "changes": None, "error": None
+    }
+    
+    if update_options.get("resolve_only"):
+        mode = "resolve"
+    else:
+        mode = "freeze" if update_options.get("use_freeze") else "direct"
+    index_url = update_options.get("index_url", DEFAULT_INDEX_URL)
+    
+    try:
+        up_to_date = False
+        if state is not None:
+            with timing_report.span("state_check"):
+                up_to_date = state.is_up_to_date(requirements_file, mode, index_url)
+        
+        if up_to_date:
+            outcome["status"] = "skipped"
+            log(color_text(f"\nSkipping {requirements_file}: unchanged and no newer versions in the index", Colors.YELLOW))
+        else:
+            outcome["result"] = update_requirements(requirements_file, **update_options)
+            with timing_report.span("diff"):
+                outcome["changes"] = diff_requirements(
+                    parse_requirements_file(outcome["result"]["backup_file"]),
+                    parse_requirements_file(requirements_file)
+                )
+            if state is not None:
+                with timing_report.span("state_record"):
+                    state.record(requirements_file, mode, index_url)
+    except Exception as e:
+        outcome["status"] = "failed"
+        outcome["error"] = str(e)
+        log(color_text(f"Error updating {requirements_file}: {e}", Colors.RED))
+        # Only now is the captured subprocess output worth showing
+        if thread_output.tail:
+            log(color_text(f"Last {len(thread_output.tail)} lines of output:", Colors.YELLOW))
+            for line in thread_output.tail:
+                log(f"    {line}")
+    finally:
+        outcome["duration"] = time.monotonic() - start_time
+        outcome["log"] = getattr(thread_output, "buffer", None)
+        thread_output.buffer = None
+        thread_output.file = None
+        thread_output.tail = None
+    
+    return outcome
+
+
+def process_files(requirements_files: Iterable[str], jobs: int = 1, **update_options: Any) -> List[Dict[str, Any]]:
+    """
+    Update requirements files, either one after another or with a bounded worker pool
+    
+    Each file gets its own temporary directory and virtualenv. In parallel mode the output
+    of every file is buffered and printed as one block once that file has finished.
+    Files are consumed lazily, so work starts while a scan is still producing paths.
+    
+    Args:
+        requirements_files: Paths to the requirements files to update
+        jobs: Maximum number of files processed at the same time
+        **update_options: Keyword arguments passed on to process_file
+        
+    Returns:
+        List of outcomes as returned by process_file, in the order of requirements_files
+    """
+    if jobs <= 1:
+        return [process_file(req_file, **update_options) for req_file in requirements_files]
+    
+    print(color_text(f"\nUpdating files using {jobs} parallel jobs...", Colors.CYAN))
+    submitted: List[str] = []
+    outcomes: Dict[str, Dict[str, Any]] = {}
+    
+    def report(future: Any) -> None:
+        outcome = future.result()
+        outcomes[outcome["file"]] = outcome
+        # Print the whole buffered log at once so files do not interleave
+        print("\n".join(outcome["log"] or []))
+    
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = set()
+        for req_file in requirements_files:
+            submitted.append(req_file)
+            pending.add(executor.submit(process_file, req_file, buffered=True, **update_options))
+            # Report files finished so far without waiting for the scan to complete
+            for future in [future for future in pending if future.done()]:
+                pending.discard(future)
+                report(future)
+        for future in as_completed(pending):
+            report(future)
+    
+    return [outcomes[req_file] for req_file in submitted]
+
+
+def print_run_summary(outcomes: List[Dict[str, Any]], total_duration: float) -> None:
+    """
+    Print a consolidated status line for every processed file
+    
+    Args:
+        outcomes: Outcomes as returned by process_files
+        total_duration: Wall-clock duration of the whole update run in seconds
+    """
+    failed = [outcome for outcome in outcomes if outcome["status"] == "failed"]
+    skipped = [outcome for outcome in outcomes if outcome["status"] == "skipped"]
+    
+    print(color_text("\nProcessed files:", Colors.BOLD))
+    for outcome in outcomes:
+        if outcome["status"] == "failed":
+            status = color_text("FAILED ", Colors.RED)
+        elif outcome["status"] == "skipped":
+            status = color_text("SKIPPED", Colors.YELLOW)
+        else:
+            status = color_text("UPDATED", Colors.GREEN)
+        print(f"  {status} {outcome['duration']:7.1f}s  {outcome['file']}")
+        if outcome["error"]:
+            print(color_text(f"          {outcome['error']}", Colors.RED))
+    
+    cumulative = sum(outcome["duration"] for outcome in outcomes)
+    print(color_text(
+        f"{len(outcomes) - len(failed) - len(skipped)} updated, {len(skipped)} skipped, {len(failed)} failed "
+        f"in {total_duration:.1f}s (cumulative {cumulative:.1f}s)",
+        Colors.RED if failed else Colors.GREEN
+    ))
+
+
 def remove_backup_files() -> None:
     """Remove all created backup files"""
     for backup_file in all_backup_files:
@@ -350,6 +1773,20 @@ def parse_arguments() -> argparse.Namespace:
         help='Specific requirements.txt files to update. If not provided, script will search for them.'
     )
     
+    parser.add_argument(
+        '--exclude',
+        action='append',
+        default=[],
+        metavar='PATTERN',
+        help='Directory name or relative path (glob) to skip when searching for requirements files; may be repeated'
+    )
+    
+    parser.add_argument(
+        '--no-gitignore',
+        action='store_true',
+        help='Also search directories and files ignored by .gitignore'
+    )
+    
     parser.add_argument(
         '-a', '--all', 
         action='store_true', 
@@ -368,6 +1805,20 @@ def parse_arguments() -> argparse.Namespace:
         help='Minimal output'
     )
     
+    parser.add_argument(
+        '-v', '--verbose',
+        action='store_true',
+        help='Show the full output of pip instead of progress lines only'
+    )
+    
+    parser.add_argument(
+        '--log-tail',
+        type=int,
+        default=DEFAULT_LOG_TAIL,
+        metavar='LINES',
+        help=f'Number of pip output lines kept per file and shown if the file fails (default: {DEFAULT_LOG_TAIL})'
+    )
+    
     parser.add_argument(
         '-f', '--freeze',
         action='store_true',
@@ -380,6 +1831,76 @@ def parse_arguments() -> argparse.Namespace:
         help='Include only direct dependencies (not subdependencies) in requirements file'
     )
     
+    parser.add_argument(
+        '--resolve-only',
+        action='store_true',
+        help='Take the latest versions from the package index without creating a virtualenv or installing anything'
+    )
+    
+    parser.add_argument(
+        '--index-url',
+        default=DEFAULT_INDEX_URL,
+        help=f'PyPI-compatible JSON API used by --resolve-only (default: {DEFAULT_INDEX_URL}); '
+             'a local directory containing <package>/json files can serve as an offline mirror'
+    )
+    
+    parser.add_argument(
+        '--per-package',
+        action='store_true',
+        help='Upgrade direct dependencies one at a time instead of in a single resolver pass'
+    )
+    
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=1,
+        help='Number of requirements files to update in parallel (0 = number of CPUs, default: 1)'
+    )
+    
+    parser.add_argument(
+        '--cache-dir',
+        default=DEFAULT_CACHE_DIR,
+        help=f'Directory of the shared virtualenv cache, not used with --freeze (default: {DEFAULT_CACHE_DIR})'
+    )
+    
+    parser.add_argument(
+        '--cache-max-size',
+        type=int,
+        default=DEFAULT_CACHE_MAX_SIZE,
+        help=f'Maximum size of the virtualenv cache in MB, least recently used entries are evicted (default: {DEFAULT_CACHE_MAX_SIZE})'
+    )
+    
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Always build a fresh virtualenv instead of reusing cached ones'
+    )
+    
+    parser.add_argument(
+        '-i', '--incremental',
+        action='store_true',
+        help='Skip files that are unchanged since their last update and have no newer versions in the index'
+    )
+    
+    parser.add_argument(
+        '--state-file',
+        default=DEFAULT_STATE_FILE,
+        help=f'State file used by --incremental (default: {DEFAULT_STATE_FILE}); '
+             'the index snapshot is taken from --index-url'
+    )
+    
+    parser.add_argument(
+        '--report',
+        metavar='PATH',
+        help='Write per-phase timings (venv creation, installs, upgrades, diff, ...) to a JSON report'
+    )
+    
+    parser.add_argument(
+        '--report-format',
+        choices=['json', 'ndjson'],
+        help='Format of --report; defaults to ndjson for .ndjson/.jsonl paths and json otherwise'
+    )
+    
     parser.add_argument(
         '--keep-backups',
         action='store_true',
@@ -409,32 +1930,47 @@ def main() -> None:
         print(color_text("Error: Cannot specify both --freeze and --direct-only", Colors.RED))
         sys.exit(1)
         
+    if args.freeze and args.resolve_only:
+        print(color_text("Error: Cannot specify both --freeze and --resolve-only", Colors.RED))
+        sys.exit(1)
+    
     if args.keep_backups and args.delete_backups:
         print(color_text("Error: Cannot specify both --keep-backups and --delete-backups", Colors.RED))
         sys.exit(1)
     
+    if args.jobs < 0:
+        print(color_text("Error: --jobs must not be negative", Colors.RED))
+        sys.exit(1)
+    jobs = args.jobs or os.cpu_count() or 1
+    
+    command_runner.verbose = args.verbose
+    command_runner.tail_lines = max(args.log_tail, 1)
+    
+    # Determine which files to update
+    update_all = args.all or args.yes
+    excludes = DEFAULT_EXCLUDES + args.exclude
+    
     # Check if specific files are provided
     if args.files:
-        requirements_files = args.files
+        requirements_files: Iterable[str] = args.files
         for file_path in requirements_files:
             if not os.path.exists(file_path):
                 print(color_text(f"Error: File not found: {file_path}", Colors.RED))
                 sys.exit(1)
+    elif update_all or args.quiet:
+        # No per-file questions, so files are processed while the scan is still running
+        requirements_files = find_requirements_files(".", excludes, use_gitignore=not args.no_gitignore)
     else:
-        # Find all requirements.txt files
-        requirements_files = glob.glob("**/requirements.txt", recursive=True)
+        requirements_files = list(find_requirements_files(".", excludes, use_gitignore=not args.no_gitignore))
+        if not requirements_files:
+            print(color_text("No requirements files found", Colors.YELLOW))
+            return
     
-    if not requirements_files:
-        print(color_text("No requirements.txt files found", Colors.YELLOW))
-        return
-    
-    if not args.quiet:
-        print(color_text(f"\nFound {len(requirements_files)} requirements.txt files:", Colors.CYAN))
+    if isinstance(requirements_files, list) and not args.quiet:
+        print(color_text(f"\nFound {len(requirements_files)} requirements files:", Colors.CYAN))
         for i, file_path in enumerate(requirements_files, 1):
             print(color_text(f"  {i}. {file_path}", Colors.CYAN))
     
-    # Determine which files to update
-    update_all = args.all or args.yes
     if not update_all and not args.quiet:
         print(color_text("\nOptions:", Colors.BOLD))
         update_all_input = get_user_input("Do you want to update all files? (yes/no): ", ["yes", "no", "y", "n"])
@@ -442,27 +1978,41 @@ def main() -> None:
     
     # Determine whether to use pip freeze
     use_freeze = args.freeze
-    if not args.freeze and not args.direct_only and not args.quiet:
+    if not args.freeze and not args.direct_only and not args.resolve_only and not args.quiet:
         print(color_text("\nDependency Options:", Colors.BOLD))
         print(color_text("1. Update only direct dependencies (cleaner requirements files)", Colors.CYAN))
         print(color_text("2. Include all subdependencies with pip freeze (more complete but verbose)", Colors.CYAN))
         freeze_choice = get_user_input("Choose option (1/2): ", ["1", "2"])
         use_freeze = freeze_choice == "2"
     
-    updated_files = []
+    selected_files: Iterable[str] = requirements_files
     
-    for req_file in requirements_files:
-        if not update_all and not args.quiet:
+    if not update_all and not args.quiet:
+        selected_files = []
+        for req_file in requirements_files:
             update_this = get_user_input(f"\nUpdate {req_file}? (yes/no): ", ["yes", "no", "y", "n"])
             if update_this not in ["yes", "y"]:
                 print(color_text(f"Skipping {req_file}", Colors.YELLOW))
                 continue
-        
-        try:
-            result = update_requirements(req_file, use_freeze=use_freeze)
-            updated_files.append(result)
-        except Exception as e:
-            print(color_text(f"Error updating {req_file}: {e}", Colors.RED))
+            selected_files.append(req_file)
+    
+    run_start = time.monotonic()
+    outcomes = process_files(
+        selected_files,
+        jobs=jobs,
+        state=UpdateState(args.state_file) if args.incremental else None,
+        use_freeze=use_freeze,
+        batch=not args.per_package,
+        resolve_only=args.resolve_only,
+        index_url=args.index_url,
+        cache_dir=None if args.no_cache else os.path.abspath(args.cache_dir),
+        cache_max_size=args.cache_max_size
+    )
+    updated_files = [outcome["result"] for outcome in outcomes if outcome["status"] == "updated"]
+    
+    if not outcomes and not isinstance(requirements_files, list):
+        print(color_text("No requirements files found", Colors.YELLOW))
+        return
     
     # Summary
     if updated_files:
@@ -470,22 +2020,31 @@ def main() -> None:
             print(color_text("\n" + "="*50, Colors.GREEN))
             print(color_text("UPDATE SUMMARY", Colors.GREEN + Colors.BOLD))
             print(color_text("="*50, Colors.GREEN))
-            print(color_text(f"Updated {len(updated_files)} requirements.txt files:", Colors.GREEN))
+            print(color_text(f"Updated {len(updated_files)} requirements files:", Colors.GREEN))
         
-        for file_info in updated_files:
-            updated_file = file_info["updated_file"]
-            backup_file = file_info["backup_file"]
+        for outcome in outcomes:
+            if outcome["status"] != "updated":
+                continue
             
-            print(color_text(f"\n- {updated_file}", Colors.GREEN))
+            print(color_text(f"\n- {outcome['file']}", Colors.GREEN))
             
-            # Check file diff
-            if check_git_available() and not args.quiet:
-                print(color_text("\nChanges in file (diff):", Colors.BOLD))
-                diff_output = show_file_diff(backup_file, updated_file)
-                print(diff_output)
+            # Show package changes
+            if not args.quiet:
+                print(color_text("\nChanges in file:", Colors.BOLD))
+                print(format_changes(outcome["changes"]))
     else:
         print(color_text("\nNo files were updated", Colors.YELLOW))
     
+    if outcomes and not args.quiet:
+        print_run_summary(outcomes, time.monotonic() - run_start)
+    
+    if args.report:
+        report_format = args.report_format
+        if not report_format:
+            report_format = "ndjson" if args.report.endswith((".ndjson", ".jsonl")) else "json"
+        timing_report.write(args.report, outcomes, report_format)
+        print(color_text(f"\nTiming report written to: {args.report}", Colors.BLUE))
+    
     # Ask about backup files
     delete_backups = args.delete_backups
     keep_backups = args.keep_backups